@@ -1,11 +1,15 @@
 import logging
+import time
+from array import array
+from itertools import chain
 
 from idna import valid_label_length
 
+import latency
 import swinput
+from subscriptions import ChangeSet, SubscriptionRegistry
 
 import customtkinter
-from tkinter import Canvas
 
 class AcquireError(Exception):
     pass
@@ -14,6 +18,8 @@ device_classes = dict()
 
 
 class Control:
+    __slots__ = ("name", "_value")
+
     def __init__(self, name: None | str):
         self.name = name
         self._value = None
@@ -27,54 +33,168 @@ class Control:
         self._value = v
 
     def __str__(self):
-        return self.name + "(" + self.value + ")"
+        return f"{self.name}({self.value})"
+
 
 class Button(Control):
+    # view onto bit <index> of the owning device's button bitset
+    __slots__ = ("_words", "index")
+
+    def __init__(self, name: str, words, index: int):
+        self.name = name
+        self._words = words
+        self.index = index
+
+    @property
+    def value(self):
+        return (self._words[self.index >> 5] >> (self.index & 31)) & 1 == 1
 
-    def __init__(self, name:str):
-        super().__init__(name)
-        self._value = False
+    @value.setter
+    def value(self, v):
+        if v:
+            self._words[self.index >> 5] |= 1 << (self.index & 31)
+        else:
+            self._words[self.index >> 5] &= ~(1 << (self.index & 31)) & 0xFFFFFFFF
 
     def __repr__(self):
         return f"Button(\"{self.name}\")"
 
 
 class Axis(Control):
-    def __init__(self, name:str, min:int, max:int):
-        super().__init__(name)
-        self.min = min
-        self.max = max
-        self._value = int((max+min)/2)
+    # view onto slot <index> of the owning device's axis value/min/max arrays
+    __slots__ = ("_storage", "index")
+
+    def __init__(self, name: str, storage, index: int):
+        self.name = name
+        self._storage = storage
+        self.index = index
+
+    @property
+    def value(self):
+        return self._storage.values[self.index]
+
+    @value.setter
+    def value(self, v):
+        self._storage.values[self.index] = v
+
+    @property
+    def min(self):
+        return self._storage.min[self.index]
+
+    @property
+    def max(self):
+        return self._storage.max[self.index]
 
     def __repr__(self):
         return f"Axis(\"{self.name}\", {self.min}, {self.max})"
 
 
+class AxisStorage:
+    __slots__ = ("values", "min", "max")
+
+    def __init__(self, count=9):
+        self.values = array("i", [0] * count)
+        self.min = array("i", [0] * count)
+        self.max = array("i", [0] * count)
+
+
 def guid_to_string(guid):
     return (f"{guid.Data1:08x}-{guid.Data2:04x}-{guid.Data3:04x}-" +
             "".join(f"{x:02x}" for x in guid.Data4[:2]) +
             "-" + "".join(f"{x:02x}" for x in guid.Data4[2:]))
 
 
+class RedrawScheduler:
+    # collects the latest value of every changed control and paints them at most max_fps times per second,
+    # intermediate values are dropped
+
+    def __init__(self, widget, paint, max_fps=60):
+        # paint(dirty, qpc) gets a dict of control: latest value and the qpc of the newest change,
+        # max_fps 0 or below paints on the next idle turn of the event loop
+        self.widget = widget
+        self.paint = paint
+        self.interval = 1 / max_fps if max_fps > 0 else 0.0
+        self._dirty = dict()
+        self._qpc = 0
+        self._job = None
+        self._last_flush = 0.0
+
+    def mark(self, changeset: ChangeSet):
+        self._dirty.update(changeset.changes)
+        self._qpc = max(self._qpc, changeset.qpc)
+        if self._job is None:
+            delay = self._last_flush + self.interval - time.perf_counter()
+            self._job = self.widget.after(max(0, int(delay * 1000)), self.flush)
+
+    def flush(self):
+        self._job = None
+        self._last_flush = time.perf_counter()
+        dirty, qpc = self._dirty, self._qpc
+        self._dirty = dict()
+        self._qpc = 0
+        if dirty:
+            self.paint(dirty, qpc)
+
+    def cancel(self):
+        if self._job is not None:
+            self.widget.after_cancel(self._job)
+            self._job = None
+        self._dirty = dict()
+        self._qpc = 0
+
+
 class DeviceViewFrame(customtkinter.CTkFrame):
+    max_fps = 60
+    refresh_on_show = True  # refreshed whenever its device is selected again, not only when first shown
 
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, max_fps=None, **kwargs):
         super().__init__(master, **kwargs)
         self.device = None
         self.scaling = customtkinter.ScalingTracker.get_widget_scaling(self)
         self.controls_canvas = None
+        self.indicators = dict()
+        self.subscription = None
+        self.redraw = RedrawScheduler(self, self.paint_changes, max_fps or self.max_fps)
+        self.latency_overlay = None
+        self._overlay_job = None
+
+    def detach(self):
+        # stops receiving and painting changes of the current device
+        if self.device and self.subscription is not None:
+            self.device.unsubscribe(self.subscription)
+            self.subscription = None
+        self.redraw.cancel()
+        if self._overlay_job is not None:
+            self.after_cancel(self._overlay_job)
+            self._overlay_job = None
 
     def refresh(self, device):
-        if self.device:
-            self.device.unsubscribe_all()
+        self.detach()
         for child in self.winfo_children():
             child.destroy()
         self.device = device
 
         self.draw_controls()
 
+    def apply_changes(self, changeset: ChangeSet):
+        # the device model already holds every value, only painting is deferred to the next frame
+        self.redraw.mark(changeset)
+
+    def paint_changes(self, dirty, qpc):
+        indicators = self.indicators
+        for control, value in dirty.items():
+            indicator = indicators.get(control)
+            if indicator is not None:
+                indicator.update_value(value)
+        if latency.tracker is not None:
+            # Tk repaints when idle, so the canvas stage is taken from the next idle callback
+            self.after_idle(latency.tracker.record, "canvas", qpc)
+
     def draw_controls(self):
-        self.controls_canvas = Canvas(
+        # all indicators are items on one canvas, self.indicators maps each control to its items
+        self.indicators = dict()
+        self.subscription = self.device.add_changeset_subscriber(self.apply_changes)
+        self.controls_canvas = customtkinter.CTkCanvas(
             self,
             width=400 * self.scaling,
             height=600 * self.scaling,
@@ -93,9 +213,7 @@ class DeviceViewFrame(customtkinter.CTkFrame):
                 if i%16==0:
                     xpos = 10 * self.scaling
                     ypos += 20 * self.scaling
-                ci = ControlIndicatorButton(self, button)
-                self.controls_canvas.create_window(xpos, ypos, window=ci)
-                self.device.add_subscriber(button, ci.update_value)
+                self.indicators[button] = ControlIndicatorButton(self.controls_canvas, button, xpos, ypos)
                 xpos += 20 * self.scaling
             ypos += 30 * self.scaling
             xpos = 10 * self.scaling
@@ -108,13 +226,23 @@ class DeviceViewFrame(customtkinter.CTkFrame):
                 if i%2 == 0:
                     xpos = 80 * self.scaling
                     ypos += 25 * self.scaling
-                ci = ControlIndicatorAxis(self, axis)
-                self.controls_canvas.create_window(xpos, ypos, window=ci)
-                self.device.add_subscriber(axis, ci.update_value)
+                self.indicators[axis] = ControlIndicatorAxis(self.controls_canvas, axis, xpos, ypos)
                 xpos += 160 * self.scaling
             ypos += 30 * self.scaling
             xpos = 10 * self.scaling
 
+        if latency.tracker is not None:
+            self.latency_overlay = self.controls_canvas.create_text(
+                0, 600 * self.scaling, text="", anchor="sw", font=("Courier", 8)
+            )
+            self.update_latency_overlay()
+
+    def update_latency_overlay(self):
+        self._overlay_job = None
+        if latency.tracker is None or self.controls_canvas is None or not self.controls_canvas.winfo_exists():
+            return
+        self.controls_canvas.itemconfig(self.latency_overlay, text=latency.tracker.summary_text())
+        self._overlay_job = self.after(500, self.update_latency_overlay)
 
 
 class Device:
@@ -122,6 +250,7 @@ class Device:
     tabs = {
         "View": DeviceViewFrame
     }
+    axis_settle_interval = 0.01  # about the report period of a moving stick
 
     def __init__(self, device_info: swinput.SWINPUT_DeviceInfo ):
         self._hash = device_info.device_hash
@@ -133,17 +262,32 @@ class Device:
         self.product_name = device_info.product_name
         self.manufacturer_name = device_info.manufacturer
 
+        # control state lives in packed arrays, Button and Axis objects are views onto them
+        self._button_words = array("I", [0] * 8)
+        self._axis_storage = AxisStorage(9)
+        self._last_axis_report = None
+        self._last_axis_present = 0
+        self._last_axis_step = 0.0
+        self.axis_pipeline = None
+
         self._buttons = dict()
-        for bi in range(device_info.button_count):
-            self._buttons[bi] = Button(f"B {bi}")
+        for bi in range(min(device_info.button_count, 32 * len(self._button_words))):
+            self._buttons[bi] = Button(f"B {bi}", self._button_words, bi)
 
         self._axes = dict()
         for axis_id in range(9):
             if device_info.axes_present & (1 << axis_id):
-                self._axes[axis_id] = Axis(f"Axis {swinput.axis_names[axis_id]}", device_info.axes_logical_min[axis_id], device_info.axes_logical_max[axis_id])
+                self._axis_storage.min[axis_id] = device_info.axes_logical_min[axis_id]
+                self._axis_storage.max[axis_id] = device_info.axes_logical_max[axis_id]
+                self._axis_storage.values[axis_id] = int((device_info.axes_logical_max[axis_id] + device_info.axes_logical_min[axis_id]) / 2)
+                self._axes[axis_id] = Axis(f"Axis {swinput.axis_names[axis_id]}", self._axis_storage, axis_id)
+
+        self.report_count = 0
+        self.last_qpc = 0
 
-        self.subscribers = dict()
-        self.subscribers["all"] = list()
+        self.subscriptions = SubscriptionRegistry()
+        self._changes = None
+        self._collect_depth = 0
 
     def __del__(self):
         self.close()
@@ -171,25 +315,34 @@ class Device:
     def hash(self):
         return self._hash
 
-    def add_subscriber(self, control, fun):
-        if control not in self.subscribers.keys():
-            self.subscribers[control] = list()
-        self.subscribers[control].append(fun)
+    def add_subscriber(self, control, fun, weak=None):
+        # control "all" subscribes fun(control, value) to every change, otherwise fun(value) to one control,
+        # weak is passed on to SubscriptionRegistry.subscribe
+        if control == "all":
+            return self.subscriptions.subscribe(SubscriptionRegistry.CHANGE, fun, weak=weak)
+        return self.subscriptions.subscribe(SubscriptionRegistry.CONTROL, fun, control=control, weak=weak)
+
+    def add_changeset_subscriber(self, fun, control_type=None, index_range=None, weak=None):
+        # fun(changeset) is called once per report, or once per frame inside begin_changes()/end_changes()
+        # with the net changes of the frame
+        return self.subscriptions.subscribe(SubscriptionRegistry.CHANGESET, fun, control_type=control_type,
+                                            index_range=index_range, weak=weak)
 
     def unsubscribe_all(self):
-        for subscriber_key in self.subscribers.keys():
-            self.subscribers[subscriber_key].clear()
+        self.subscriptions.clear()
 
-    def unsubscribe(self, control, fun):
-        for control in self.subscribers.keys():
-            if fun in self.subscribers[control]:
-                self.subscribers[control].remove(fun)
+    def unsubscribe(self, handle, fun=None):
+        # accepts a handle returned by add_subscriber, or the control and callback it was registered with
+        if fun is None:
+            return self.subscriptions.unsubscribe(handle)
+        control = None if handle == "all" else handle
+        return any([self.subscriptions.unsubscribe(h) for h in list(self.subscriptions.find(fun, control))])
 
     def close(self):
         self.unsubscribe_all()
 
     def get_controls(self):
-        return (self._buttons | self._axes).values()
+        return chain(self._buttons.values(), self._axes.values())
 
     def get_buttons(self):
         return self._buttons.values()
@@ -197,16 +350,33 @@ class Device:
     def get_axes(self):
         return self._axes.values()
 
+    def begin_changes(self):
+        if self._collect_depth == 0:
+            self._changes = dict()
+        self._collect_depth += 1
+
+    def end_changes(self):
+        self._collect_depth -= 1
+        if self._collect_depth > 0:
+            return
+        # controls that are back at their value from begin_changes() are left out
+        changes = {control: value for control, (initial, value) in self._changes.items() if value != initial}
+        self._changes = None
+        if changes:
+            self.subscriptions.dispatch_changeset(ChangeSet(self, changes, self.last_qpc))
+
     def update_control(self, control, value):
         if value == control.value:
             return
+        initial = control.value
         control.value = value
         logging.debug(f"{self}:{control.name}:{value}")
-        for subscriber in self.subscribers["all"]:
-            subscriber(control, value)
-        if control in self.subscribers.keys():
-            for subscriber in self.subscribers[control]:
-                subscriber(value)
+        # only change set subscribers are coalesced between begin_changes() and end_changes()
+        self.subscriptions.dispatch_change(control, value)
+        if self._changes is not None:
+            self._changes[control] = (self._changes.get(control, (initial,))[0], value)
+        else:
+            self.subscriptions.dispatch_changeset(ChangeSet(self, {control: value}, self.last_qpc))
 
     def update_button(self, button_index, value):
         self.update_control(self._buttons[button_index], value)
@@ -214,6 +384,110 @@ class Device:
     def update_axis(self, axis_index, value):
         self.update_control(self._axes[axis_index], value)
 
+    def update_report(self, report: swinput.SWINPUT_DecodedReport):
+        self.report_count += 1
+        self.last_qpc = report.qpc
+        self.begin_changes()
+        try:
+            if report.button_count > 0:
+                self.update_buttons(report.buttons, report.button_count)
+            if report.axis_present:
+                self.update_axes(report.axis, report.axis_present)
+            if latency.tracker is not None:
+                latency.tracker.record("model", report.qpc)
+        finally:
+            self.end_changes()
+
+    def update_buttons(self, words, button_count):
+        # only buttons whose bit toggled since the previous report are dispatched
+        current = self._button_words
+        button_count = min(button_count, len(self._buttons))
+        for word_index in range((button_count + 31) // 32):
+            word = words[word_index]
+            changed = word ^ current[word_index]
+            if word_index == button_count // 32:
+                changed &= (1 << (button_count % 32)) - 1
+            if not changed:
+                continue
+            base = word_index * 32
+            while changed:
+                lowest = changed & -changed
+                changed ^= lowest
+                self.update_button(base + lowest.bit_length() - 1, word & lowest != 0)
+
+    def enable_axis_pipeline(self, **settings):
+        # settings are passed to AxisPipeline.configure and can be changed live via self.axis_pipeline
+        if self.axis_pipeline is None:
+            from axis_pipeline import AxisPipeline  # numpy is only needed once the pipeline is used
+            self.axis_pipeline = AxisPipeline(self._axis_storage.min, self._axis_storage.max)
+        self.axis_pipeline.configure(**settings)
+        return self.axis_pipeline
+
+    def disable_axis_pipeline(self):
+        self.axis_pipeline = None
+        self._last_axis_report = None
+
+    def update_axes(self, axis, axis_present):
+        self._last_axis_present = axis_present
+        if self.axis_pipeline is not None:
+            values = self.axis_pipeline.process(axis).tolist()
+            self._last_axis_step = time.perf_counter()
+        else:
+            values = axis[:]
+            if values == self._last_axis_report:
+                return
+            self._last_axis_report = values
+        self.apply_axes(values, axis_present)
+
+    def settle_axes(self, now=None):
+        # called on every drain tick. The devices only report changes, so while they are quiet the smoothing is
+        # stepped once per axis_settle_interval until the axes reach their input
+        if self.axis_pipeline is None or self.axis_pipeline.settled:
+            return
+        if now is None:
+            now = time.perf_counter()
+        steps = min(100, int((now - self._last_axis_step) / self.axis_settle_interval))
+        if steps <= 0:
+            return
+        self._last_axis_step = now
+        for _ in range(steps):
+            values = self.axis_pipeline.process()
+            if self.axis_pipeline.settled:
+                break
+        self.begin_changes()
+        try:
+            self.apply_axes(values.tolist(), self._last_axis_present)
+        finally:
+            self.end_changes()
+
+    def apply_axes(self, values, axis_present):
+        current = self._axis_storage.values
+        for axis_id in self._axes.keys():
+            if axis_present & (1 << axis_id) and values[axis_id] != current[axis_id]:
+                self.update_axis(axis_id, values[axis_id])
+
+    def snapshot(self):
+        # whole-device state as one buffer, comparable and exportable without touching the controls
+        return self._button_words.tobytes() + self._axis_storage.values.tobytes()
+
+    def restore(self, snapshot):
+        # subscribers see the restored controls like a report, as one change set
+        words = len(self._button_words) * self._button_words.itemsize
+        button_words = array("I", snapshot[:words])
+        axis_values = array("i", snapshot[words:])
+        self.begin_changes()
+        try:
+            for index, button in self._buttons.items():
+                self.update_control(button, (button_words[index >> 5] >> (index & 31)) & 1 == 1)
+            for axis_id, axis in self._axes.items():
+                self.update_control(axis, axis_values[axis_id])
+        finally:
+            self.end_changes()
+        self._last_axis_report = None
+        if self.axis_pipeline is not None:
+            self.axis_pipeline.reset()
+
+
 class ControlIndicatorBase:
 
     def update_value(self, value):
@@ -241,80 +515,119 @@ class ControlIndicatorText(ControlIndicatorBase, customtkinter.CTkLabel):
         )
 
 
-class ControlIndicatorButton(ControlIndicatorBase, customtkinter.CTkCanvas):
+class ControlIndicatorItems(ControlIndicatorBase):
+    # a group of items on a shared canvas, centered on x, y like an embedded window would be
+
+    def __init__(self, canvas, control, x, y, width, height):
+        ControlIndicatorBase.__init__(self, canvas, control)
+        self.canvas = canvas
+        self.x0 = x - width / 2
+        self.y0 = y - height / 2
+
+
+class ControlIndicatorButton(ControlIndicatorItems):
     bgs = {
         True: "green1",
         False: "darkgray",
     }
 
-    def __init__(self, master, control, size=20, **kwargs):
-        ControlIndicatorBase.__init__(self, master, control)
-        customtkinter.CTkCanvas.__init__(
-            self,
-            master=master,
-            width=size*self._scaling,
-            height=size*self._scaling,
-            bg=master["background"],
-            bd=0,
-            highlightthickness=0
-        )
+    def __init__(self, canvas, control, x, y, size=20):
+        scaling = customtkinter.ScalingTracker.get_widget_scaling(canvas)
+        ControlIndicatorItems.__init__(self, canvas, control, x, y, size * scaling, size * scaling)
         number = [int(s) for s in control.name.split() if s.isdigit()][0]
-        center = int(size/2*self._scaling)
+        center_x = self.x0 + int(size / 2 * scaling)
+        center_y = self.y0 + int(size / 2 * scaling)
         radius = int(size/2*self._scaling)
-        self.circle = self.create_aa_circle(center, center, radius, fill="darkgray")
-        self.text = self.create_text(center, center, text=str(number), anchor="center")
+        self.circle = canvas.create_aa_circle(center_x, center_y, radius, fill="darkgray")
+        self.text = canvas.create_text(center_x, center_y, text=str(number), anchor="center")
 
     def update_value(self, value):
         if value:
             self.bgs[False] = "darkseagreen"
-        self.itemconfig(self.circle, fill=self.bgs.get(value, "black"))
+        self.canvas.itemconfig(self.circle, fill=self.bgs.get(value, "black"))
 
-class ControlIndicatorAxis(ControlIndicatorBase, customtkinter.CTkCanvas):
-    def __init__(self, master, control:Axis, thickness=20, length=150, **kwargs):
-        ControlIndicatorBase.__init__(self, master, control)
-        customtkinter.CTkCanvas.__init__(
-            self,
-            master=master,
-            width=length*self._scaling,
-            height=thickness*self._scaling,
-            bg=master["background"],
-            bd=0,
-            highlightthickness=0
-        )
+
+class ControlIndicatorAxis(ControlIndicatorItems):
+
+    def __init__(self, canvas, control: Axis, x, y, thickness=20, length=150):
+        scaling = customtkinter.ScalingTracker.get_widget_scaling(canvas)
+        ControlIndicatorItems.__init__(self, canvas, control, x, y, length * scaling, thickness * scaling)
         self.thickness = thickness*self._scaling
         self.length = length*self._scaling
-        x_center = int(length/2*self._scaling)
-        y_center = int(thickness/2 *self._scaling)
         self.range = (self.control.max - self.control.min)
         self.used_range_min = control.value
         self.used_range_max = control.value
-        self.background = self.create_rectangle(0,0,self.length, self.thickness, fill="darkgray")
-        self.used_range = self.create_rectangle(
-            self.used_range_min/self.range*self.length + 1,
-            1,
-            self.used_range_max/self.range*self.length,
-            self.thickness,
+        x0, y0 = self.x0, self.y0
+        self.background = canvas.create_rectangle(x0, y0, x0 + self.length, y0 + self.thickness, fill="darkgray")
+        self.used_range = canvas.create_rectangle(
+            *self.used_range_coords(),
             fill="darkseagreen",
             outline=""
         )
-        self.indicator = self.create_rectangle(self.length/2-1,1,self.length/2+1, self.thickness-1, fill="green1", outline="")
-        self.text = self.create_text(x_center, y_center, text=str(control.name), anchor="center")
+        self.indicator = canvas.create_rectangle(x0 + self.length/2-1, y0 + 1, x0 + self.length/2+1,
+                                                 y0 + self.thickness-1, fill="green1", outline="")
+        self.text = canvas.create_text(x, y, text=str(control.name), anchor="center")
+
+    def used_range_coords(self):
+        return (
+            self.x0 + self.used_range_min / self.range * self.length + 1,
+            self.y0 + 1,
+            self.x0 + self.used_range_max / self.range * self.length,
+            self.y0 + self.thickness
+        )
 
     def update_value(self, value):
-        self.used_range_min = min(self.used_range_min, value)
-        self.used_range_max = max(self.used_range_max, value)
         relval = value / self.range
-        self.coords(
-            self.indicator,  # x0
-            relval*self.length-1,  # y0
-            1,  # x1
-            int(relval*self.length)+1,  # y1
-            self.thickness-1
+        self.canvas.coords(
+            self.indicator,
+            self.x0 + relval*self.length-1,  # x0
+            self.y0 + 1,  # y0
+            self.x0 + int(relval*self.length)+1,  # x1
+            self.y0 + self.thickness-1  # y1
         )
-        self.coords(
-            self.used_range,
-            self.used_range_min / self.range * self.length + 1,
-            1,
-            self.used_range_max / self.range * self.length,
-            self.thickness
-        )
\ No newline at end of file
+        # the used range item is only touched when the range grows
+        if value < self.used_range_min or value > self.used_range_max:
+            self.used_range_min = min(self.used_range_min, value)
+            self.used_range_max = max(self.used_range_max, value)
+            self.canvas.coords(self.used_range, *self.used_range_coords())
+
+
+class DeviceRegistry:
+
+    def __init__(self, create_device, enumerate_devices=swinput.enumerate_devices):
+        # create_device(device_info) returns a Device or None for devices that are not of interest
+        self._create_device = create_device
+        self._enumerate_devices = enumerate_devices
+        self._seen = set()
+        self.devices = dict()
+
+    def update(self):
+        # diffs the enumerated devices by hash, existing Device objects are kept alive
+        device_infos = {device_info.device_hash: device_info for device_info in self._enumerate_devices()}
+
+        removed = list()
+        for device_hash in list(self.devices.keys()):
+            if device_hash not in device_infos:
+                self.forget(device_hash)
+                removed.append(device_hash)
+        self._seen &= device_infos.keys()
+
+        added = list()
+        for device_hash, device_info in device_infos.items():
+            if device_hash in self._seen:
+                continue
+            self._seen.add(device_hash)
+            device = self._create_device(device_info)
+            if device is None:
+                continue
+            self.devices[device_hash] = device
+            added.append(device_hash)
+        return added, removed
+
+    def forget(self, device_hash):
+        # the device is created anew on the next update, e.g. after a firmware update
+        self._seen.discard(device_hash)
+        device = self.devices.pop(device_hash, None)
+        if device is not None:
+            device.close()
+        return device
@@ -11,19 +11,23 @@ import semantic_version
 import requests
 from tempfile import TemporaryDirectory
 
-from serial.serialutil import SerialException
-
 from Device import Device, DeviceViewFrame, device_classes
-import serial
 from serial.tools.list_ports import comports
 import logging
 import os
-from PIL import Image, ImageTk
 from tkinter import N, NE, E, SE, S, SW, W, NW, Canvas
 from copy import deepcopy
 from more_itertools import batched
 from itertools import product
+from typing import NamedTuple
 import swinput
+import image_cache
+import serial_pool
+from serial_worker import SerialWorker, then
+
+
+# requests to the firmware server run here, never on the serial worker of a device
+server_worker = SerialWorker("firmware-server", default_timeout=15.0)
 
 
 class NotSwitchologyDeviceError(TypeError):
@@ -34,12 +38,12 @@ class NoSerialNumberError(Exception):
 
 
 class SwitchologyDeviceViewFrame(DeviceViewFrame):
+    imgdir = r"res/modimgs/prototype_v_0_4"
 
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
-        self.images = dict()
         self.subsample = kwargs.get("subsample", 3.556)
-        self.load_images()
+        self.image_scale = self.scaling
         self.offset_x = 0
         self.offset_y = 0
         self.modulesize = 100 * self.scaling
@@ -48,24 +52,24 @@ class SwitchologyDeviceViewFrame(DeviceViewFrame):
         self.canvas = None
 
     def refresh(self, device):
+        self.detach()
         for child in self.winfo_children():
             child.destroy()
         self.device = device
+        if device.cached_config is None:
+            # the modules are drawn once the configuration has been read on the serial worker
+            then(device.config_snapshot_async(), lambda config: self.config_ready(device))
         self.draw_device(device)
         self.draw_controls()
 
-    def load_images(self):
-        imgdir = r"res/modimgs/prototype_v_0_4"
-        for filename in os.listdir(imgdir):
-            filepath = os.path.join(imgdir, filename)
-            if not os.path.isfile(filepath):
-                continue
-            im = Image.open(filepath)
-            im = im.resize((
-                int(im.width / self.subsample * self.scaling ),
-                int(im.height / self.subsample * self.scaling),
-            ))
-            self.images[os.path.basename(filepath).lower()] = im
+    def config_ready(self, device):
+        if self.winfo_exists() and self.device is device:
+            self.refresh(device)
+
+    def get_image(self, imgname, rotation=0):
+        # images are loaded on first use and shared with every other view through the image cache
+        return image_cache.cache.get_photo(os.path.join(self.imgdir, imgname), self.image_scale, self.subsample,
+                                           rotation)
 
     def draw_device(self, device=None):
 
@@ -80,13 +84,14 @@ class SwitchologyDeviceViewFrame(DeviceViewFrame):
         )
         self.canvas.grid(row=0, column=0)
         self.canvas.delete("all")
-        self.base_image = ImageTk.PhotoImage(self.images.get("base_3x5.png"))
+        self.base_image = self.get_image("base_3x5.png")
         self.canvas.create_image(0, 0, image=self.base_image, anchor=NW)
 
         if device is None:
             return
 
-        build_id = device.build_id
+        config = device.cached_config  # never blocks on the serial port
+        build_id = None if config is None else config.build_id
         if build_id is None:
             return
 
@@ -130,11 +135,10 @@ class SwitchologyDeviceViewFrame(DeviceViewFrame):
 
             if imgname in ["xx.png", "--.png"]:
                 continue
-            if imgname in self.images.keys():
-                self.modulegrid[(ix, iy)]["image"] = ImageTk.PhotoImage(
-                    self.images.get(imgname).rotate(rotation, expand=1)
-                )
-                self.canvas.create_image(xm, ym, image=self.modulegrid[(ix, iy)]["image"], anchor=anchor, )
+            image = self.get_image(imgname, rotation)
+            if image is not None:
+                self.modulegrid[(ix, iy)]["image"] = image
+                self.canvas.create_image(xm, ym, image=image, anchor=anchor, )
             else:
                 logging.error(f"did not find module image \"{imgname}\"!")
             if logging.root.level <= logging.DEBUG:
@@ -148,20 +152,13 @@ class SwitchologyDeviceViewFrame(DeviceViewFrame):
 
 class SwitchologyAlphaDeviceViewRame(SwitchologyDeviceViewFrame):
 
+    imgdir = r"res/modimgs/prototype_v_0_2"
+
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
         self.offset_x = 25
         self.offset_y = 25
-
-    def load_images(self):
-        imgdir = r"res/modimgs/prototype_v_0_2"
-        for filename in os.listdir(imgdir):
-            filepath = os.path.join(imgdir, filename)
-            if not os.path.isfile(filepath):
-                continue
-            im = Image.open(filepath)
-            im = im.resize((int(im.width / self.subsample), int(im.height / self.subsample)))
-            self.images[os.path.basename(filepath).lower()] = im
+        self.image_scale = 1.0
 
     def draw_device(self, device=None):
         def try_rot_perm(rp):
@@ -249,13 +246,14 @@ class SwitchologyAlphaDeviceViewRame(SwitchologyDeviceViewFrame):
         )
         self.canvas.grid()
         self.canvas.delete("all")
-        self.base_image = ImageTk.PhotoImage(self.images.get("base_3x5.png"))
+        self.base_image = self.get_image("base_3x5.png")
         self.canvas.create_image(0, 0, image=self.base_image, anchor=NW)
 
         if device is None:
             return
 
-        build_id = device.build_id
+        config = device.cached_config  # never blocks on the serial port
+        build_id = None if config is None else config.build_id
         if build_id is None:
             return
 
@@ -324,11 +322,10 @@ class SwitchologyAlphaDeviceViewRame(SwitchologyDeviceViewFrame):
 
             if imgname in ["xx.png", "--.png"]:
                 continue
-            if imgname in self.images.keys():
-                self.modulegrid[(ix, iy)]["image"] = ImageTk.PhotoImage(
-                    self.images.get(imgname).rotate(rotation, expand=1)
-                )
-                self.canvas.create_image(xm, ym, image=self.modulegrid[(ix, iy)]["image"], anchor=anchor, )
+            image = self.get_image(imgname, rotation)
+            if image is not None:
+                self.modulegrid[(ix, iy)]["image"] = image
+                self.canvas.create_image(xm, ym, image=image, anchor=anchor, )
             else:
                 logging.error(f"did not find module image \"{imgname}\"!")
             if logging.root.level <= logging.DEBUG:
@@ -341,6 +338,7 @@ class SwitchologyAlphaDeviceViewRame(SwitchologyDeviceViewFrame):
 
 
 class SwitchologyDeviceConfigFrame(DeviceViewFrame):
+    refresh_on_show = False
     mode2s = dict({x: f"B{x}" for x in range(1, 15)})  # B-Modes
     mode2s[0x00] = 'A'
     mode2s[0x0F] = 'C'
@@ -357,6 +355,30 @@ class SwitchologyDeviceConfigFrame(DeviceViewFrame):
         value = 256 * int(self.var_mode1.get()) + bmode
         self.var_mode.set(f"0x{value:04x}")
 
+    # host-side axis processing, applied live and not written to the device
+    host_smoothings = {"Off": 0.0, "Low": 0.5, "Medium": 0.75, "High": 0.9}
+    host_curves = {"Linear": 1.0, "Soft": 1.5, "Softer": 2.0, "Progressive": 3.0}
+
+    def host_axis_update(self, choice=None):  # noqa
+        smoothing = self.host_smoothings[self.cbx_hsmo.get()]
+        curve = self.host_curves[self.cbx_hcur.get()]
+        if smoothing == 0.0 and curve == 1.0:
+            self.device.disable_axis_pipeline()
+            return
+        try:
+            self.device.enable_axis_pipeline(smoothing=smoothing, curve=curve)
+        except ImportError as e:
+            logging.error(f"host axis processing is not available: {e}")
+            self.cbx_hsmo.set("Off")
+            self.cbx_hcur.set("Linear")
+
+    def show_host_axis_settings(self, device):
+        pipeline = device.axis_pipeline
+        smoothing = 0.0 if pipeline is None else float(pipeline.smoothing[0])
+        curve = 1.0 if pipeline is None else float(pipeline.curve[0])
+        self.cbx_hsmo.set(next((k for k, v in self.host_smoothings.items() if v == smoothing), "Off"))
+        self.cbx_hcur.set(next((k for k, v in self.host_curves.items() if v == curve), "Linear"))
+
     def module_mode_8way_update(self, choice):
         if choice == "as 8+1 buttons":
             self.module_modes = self.module_modes | 0x01
@@ -380,6 +402,7 @@ class SwitchologyDeviceConfigFrame(DeviceViewFrame):
         super().__init__(master, **kwargs)
 
         self.module_modes = 0x00
+        self.writable = set()  # setters whose field was read from the device
 
         self.firmware_update_checked = False
 
@@ -487,10 +510,32 @@ class SwitchologyDeviceConfigFrame(DeviceViewFrame):
         self.ent_jsdz = customtkinter.CTkEntry(frm_elmo, textvariable=self.var_jsdz)
         self.ent_jsdz.grid(row=4, column=1)
 
-        self.lbl_jsdz = customtkinter.CTkLabel(frm_elmo, text="Joystick Saturation", padx=2, pady=2)
-        self.lbl_jsdz.grid(row=5, column=0, padx=2, sticky="w")
-        self.ent_jsdz = customtkinter.CTkEntry(frm_elmo, textvariable=self.var_jssa)
-        self.ent_jsdz.grid(row=5, column=1)
+        self.lbl_jssa = customtkinter.CTkLabel(frm_elmo, text="Joystick Saturation", padx=2, pady=2)
+        self.lbl_jssa.grid(row=5, column=0, padx=2, sticky="w")
+        self.ent_jssa = customtkinter.CTkEntry(frm_elmo, textvariable=self.var_jssa)
+        self.ent_jssa.grid(row=5, column=1)
+
+        self.lbl_hsmo = customtkinter.CTkLabel(frm_elmo, text="Host Axis Smoothing", padx=2, pady=2)
+        self.lbl_hsmo.grid(row=6, column=0, padx=2, sticky="w")
+        self.cbx_hsmo = customtkinter.CTkComboBox(
+            master=frm_elmo,
+            values=list(self.host_smoothings.keys()),
+            command=self.host_axis_update,
+            state="readonly",
+        )
+        self.cbx_hsmo.set("Off")
+        self.cbx_hsmo.grid(row=6, column=1, padx=2, sticky="ew")
+
+        self.lbl_hcur = customtkinter.CTkLabel(frm_elmo, text="Host Response Curve", padx=2, pady=2)
+        self.lbl_hcur.grid(row=7, column=0, padx=2, sticky="w")
+        self.cbx_hcur = customtkinter.CTkComboBox(
+            master=frm_elmo,
+            values=list(self.host_curves.keys()),
+            command=self.host_axis_update,
+            state="readonly",
+        )
+        self.cbx_hcur.set("Linear")
+        self.cbx_hcur.grid(row=7, column=1, padx=2, sticky="ew")
 
         frm_elmo.grid(row=8, column=0, columnspan=2, sticky="ew")
 
@@ -499,18 +544,52 @@ class SwitchologyDeviceConfigFrame(DeviceViewFrame):
         self.btn_reset = customtkinter.CTkButton(self, text="Factory Reset and Restart", command=self.factory_reset, fg_color="red", text_color="white")
         self.btn_reset.grid(row=9, column=1)
 
+        # the widgets of each setter, disabled while its field could not be read
+        self.setter_widgets = {
+            "sbm": [self.cbx_mode1, self.cbx_mode2],
+            "sup": [self.ent_udpe],
+            "sbf": [self.ent_blfc],
+            "sem": [self.cbx_8wmd, self.cbx_tgmd, self.cbx_rsmd],
+            "sjs": [self.ent_jsdz, self.ent_jssa],
+        }
+
     def refresh(self, device):
         self.device = device
-        self.var_buid.set(device.build_id)
-        self.var_hwve.set(device.hwver)
-        self.var_fwve.set(device.fwver)
-        self.var_mode.set(device.base_mode)
-        self.var_udpe.set(device.update_period)
-        self.var_blfc.set(device.backlight_factor)
-        self.var_jsdz.set(device.joystick_deadzone)
-        self.var_jssa.set(device.joystick_saturation)
-
-        self.module_modes = device.module_mode
+        self.show_host_axis_settings(device)
+        self.btn_write.configure(state="disabled")
+        self.btn_reset.configure(state="disabled")
+        then(device.config_snapshot_async(), lambda config: self.show_config(device, config),
+             lambda e: logging.error(f"could not read configuration of {device}: {e!r}"))
+
+    def show_config(self, device, config):
+        if not self.winfo_exists() or self.device is not device:
+            return
+        self.btn_write.configure(state="normal")
+        self.btn_reset.configure(state="normal")
+        # fields the device did not report stay empty and are not written back
+        for var, value in [
+            (self.var_buid, config.build_id),
+            (self.var_hwve, config.hwver),
+            (self.var_fwve, config.fwver),
+            (self.var_udpe, config.update_period),
+            (self.var_blfc, config.backlight_factor),
+            (self.var_jsdz, config.joystick_deadzone),
+            (self.var_jssa, config.joystick_saturation),
+        ]:
+            var.set("" if value is None else value)
+        self.writable = set()
+        if config.update_period is not None:
+            self.writable.add("sup")
+        if config.backlight_factor is not None:
+            self.writable.add("sbf")
+        if config.joystick_deadzone is not None:
+            self.writable.add("sjs")
+        if config.module_mode is not None:
+            self.writable.add("sem")
+        for field, error in config.errors:
+            logging.warning(f"could not read {field} of {device}: {error}")
+
+        self.module_modes = config.module_mode or 0x00
         if self.module_modes & 0x01:
             self.cbx_8wmd.set("as 8+1 buttons")
         else:
@@ -524,27 +603,68 @@ class SwitchologyDeviceConfigFrame(DeviceViewFrame):
         else:
             self.cbx_rsmd.set("Continuous")
 
-
-        mode = int(self.var_mode.get(), 16)
+        try:
+            mode = int(config.base_mode, 16)
+        except (TypeError, ValueError):
+            mode = None
+        if mode is None or mode % 256 not in self.mode2s:
+            self.var_mode1.set("")
+            self.var_mode2.set("")
+            self.var_mode.set("")
+            self.update_setter_widgets()
+            return
+        self.var_mode.set(config.base_mode)
         mode1 = int(mode / 256)
         mode2 = int(mode % 256)
         self.var_mode1.set(str(mode1))
         self.var_mode2.set(self.mode2s[mode2])
+        self.writable.add("sbm")
+        self.update_setter_widgets()
+
+    def update_setter_widgets(self):
+        self.btn_write.configure(state="normal" if self.writable else "disabled")
+        for setter, widgets in self.setter_widgets.items():
+            for widget in widgets:
+                if setter not in self.writable:
+                    widget.configure(state="disabled")
+                elif isinstance(widget, customtkinter.CTkComboBox):
+                    widget.configure(state="readonly")
+                else:
+                    widget.configure(state="normal")
 
     def write_all(self):
-        for command in [
-            f'sbm {self.var_mode.get()}',
-            f'sup {hex(int(self.var_udpe.get()))}',
-            f'sbf {hex(int(self.var_blfc.get()))}',
-            f'sem {hex(self.module_modes)}',
-            f'sjs {hex(int(self.var_jsdz.get())<<8 | int(self.var_jssa.get()))}',
-        ]:
-            ans = self.device.send_command(command)
-            if "ok" in ans.lower():
-                logging.info(f"Successful write to device ({command})")
-            else:
-                logging.error(f"Failed to write to device ({command})!")
-        self.device.send_command('rst')
+        def log_results(results):
+            failed = list()
+            for result in results:
+                if result.ok:
+                    logging.info(f"Successful write to device ({result.command})")
+                else:
+                    logging.error(f"Could not confirm write to device ({result.command}): {result.error}!")
+                    failed.append(f"{result.command}: {result.error}")
+            if failed:
+                messagebox.showwarning(
+                    title="Write not confirmed",
+                    message="The device did not confirm all settings, it restarts with whatever it applied:\n"
+                            + "\n".join(failed)
+                )
+
+        commands = list()
+        if "sbm" in self.writable:
+            commands.append(f'sbm {self.var_mode.get()}')
+        if "sup" in self.writable:
+            commands.append(f'sup {hex(int(self.var_udpe.get()))}')
+        if "sbf" in self.writable:
+            commands.append(f'sbf {hex(int(self.var_blfc.get()))}')
+        if "sem" in self.writable:
+            commands.append(f'sem {hex(self.module_modes)}')
+        if "sjs" in self.writable:
+            commands.append(f'sjs {hex(int(self.var_jsdz.get())<<8 | int(self.var_jssa.get()))}')
+        if not commands:
+            logging.warning("nothing to write, the configuration could not be read from the device")
+            return
+        future = self.device.send_commands_async(commands, check=lambda ans: "ok" in ans.lower())
+        then(future, log_results)
+        self.device.send_command_async('rst')  # queued behind the writes
 
     def factory_reset(self):
         if not tkinter.messagebox.askokcancel(
@@ -552,12 +672,14 @@ class SwitchologyDeviceConfigFrame(DeviceViewFrame):
             message="This will reset all the configuration to default values!\nDo you wish to proceed?"
         ):
             return
-        ans = self.device.send_command('fmt')
-        if "ok" in ans.lower():
-            logging.info(f"Successful write to device (fmt)")
-            self.device.send_command('rst')
-        else:
-            logging.error(f"Failed to write to device (fmt)!")
+        def formatted(ans):
+            if ans and "ok" in ans.lower():
+                logging.info(f"Successful write to device (fmt)")
+                self.device.send_command_async('rst')
+            else:
+                logging.error(f"Failed to write to device (fmt)!")
+
+        then(self.device.send_command_async('fmt'), formatted)
 
 
 def verify_firmware(filepath):
@@ -594,6 +716,7 @@ def verify_firmware(filepath):
 
 
 class SwitchologyDeviceUpdateFrame(DeviceViewFrame):
+    refresh_on_show = False
 
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
@@ -630,59 +753,86 @@ class SwitchologyDeviceUpdateFrame(DeviceViewFrame):
 
     def update_from_server(self):
         def perform_update():
-            with TemporaryDirectory() as tempdir:
-                logging.info("firmware file downloading to PC...")
-                self.lbl_info.configure(text="Downloading to PC...")
-                logging.debug(f"temporary directory created: \"{tempdir}\"")
-                file_response = requests.get(response_json.get("url"))
-                hash_calculator = hashlib.sha256()
-                firmware_file_path = os.path.join(tempdir, f"{response_json.get('tag')}.bin")
-                with open(firmware_file_path, "w+b") as firmware_file:
-                    for chunk in file_response.iter_content(chunk_size=8192):
-                        firmware_file.write(chunk)
-                        hash_calculator.update(chunk)
-
-                    # firmware_file.seek(0)
-                firmware_hash = hash_calculator.hexdigest()
-
-                if firmware_hash != response_json.get('hash'):
-                    logging.error(f"firmware file download to PC was not successful!")
-                    self.lbl_info.configure(text="Downloading to PC not successful!")
-                    messagebox.showerror(
-                        title="Downloading to PC not successful!",
-                        message=f"The new firmware could not be downloaded to your PC!"
-                    )
-                    return
-
-                logging.info("firmware file downloaded to PC")
-                self.lbl_info.configure(text="Downloading to PC successful")
-                self.firmwarepath.set(firmware_file.name)
-                self.update_firmware()
+            # the firmware file is needed until the update has finished in the background
+            tempdir_handle = TemporaryDirectory()
+            tempdir = tempdir_handle.name
+            logging.info("firmware file downloading to PC...")
+            self.lbl_info.configure(text="Downloading to PC...")
+            logging.debug(f"temporary directory created: \"{tempdir}\"")
+            file_response = requests.get(response_json.get("url"))
+            hash_calculator = hashlib.sha256()
+            firmware_file_path = os.path.join(tempdir, f"{response_json.get('tag')}.bin")
+            with open(firmware_file_path, "w+b") as firmware_file:
+                for chunk in file_response.iter_content(chunk_size=8192):
+                    firmware_file.write(chunk)
+                    hash_calculator.update(chunk)
+
+                # firmware_file.seek(0)
+            firmware_hash = hash_calculator.hexdigest()
+
+            if firmware_hash != response_json.get('hash'):
+                logging.error(f"firmware file download to PC was not successful!")
+                self.lbl_info.configure(text="Downloading to PC not successful!")
+                messagebox.showerror(
+                    title="Downloading to PC not successful!",
+                    message=f"The new firmware could not be downloaded to your PC!"
+                )
+                tempdir_handle.cleanup()
+                return
+
+            logging.info("firmware file downloaded to PC")
+            self.lbl_info.configure(text="Downloading to PC successful")
+            self.firmwarepath.set(firmware_file.name)
+            self.update_firmware(on_done=tempdir_handle.cleanup)
+
+        def check_server():
+            # runs on the firmware server worker, a slow server must not hold up the device's serial queue
+            logging.info("requesting firmware information from server...")
+            response = requests.get(update_server_url, timeout=10)
+            return response.json()
+
+        def collect(key, value):
+            results[key] = value
+            if len(results) == 2:
+                offer_update(results["server"], results["fwver"])
+
+        def offer_update(server_json, fwver):
+            nonlocal response_json
+            response_json = server_json
+            if fwver == response_json.get('tag'):
+                logging.info("firmware is up to date")
+                return
+            ans = messagebox.askquestion(
+                    title="Firmware update available!",
+                    message=f"There is a new version available! Do you want to update?\n"
+                            f"current version: \"{fwver}\", new version: \"{response_json.get('tag')}\"\n"
+                            f"published at: {response_json.get('published_at')}\n"
+            )
+            if ans == 'yes':
+                self.master.master.set("Update")
+                self.after(100, perform_update)
+
+        def check_failed(e):
+            logging.error(f"could not check for firmware updates: {e!r}")
 
         update_server_url = "https://us-central1-switchology-a3b47.cloudfunctions.net/download_latest_firmware"
-        logging.info("requesting firmware information from server...")
-        response = requests.get(update_server_url)
-        response_json = response.json()
-        if self.device.fwver == response_json.get('tag'):
-            logging.info("firmware is up to date")
-            return
-        ans = messagebox.askquestion(
-                title="Firmware update available!",
-                message=f"There is a new version available! Do you want to update?\n"
-                        f"current version: \"{self.device.fwver}\", new version: \"{response_json.get('tag')}\"\n"
-                        f"published at: {response_json.get('published_at')}\n"
-        )
-        if ans == 'yes':
-            self.master.master.set("Update")
-            self.after(100, perform_update)
+        response_json = None
+        results = dict()
+        device = self.device
+        then(server_worker.submit(check_server, timeout=15), lambda r: collect("server", r), check_failed)
+        then(device.submit(lambda: device.fwver), lambda v: collect("fwver", v), check_failed)
+
+    def update_firmware(self, on_done=None):
+        def finish():
+            if on_done is not None:
+                on_done()
 
-    def update_firmware(self):
         def wait_for_reconnect(numsec):
             if numsec > 0:
                 self.lbl_info.configure(text=f"Complete. Waiting for device to restart {numsec}s...")
-                time.sleep(1)
-                self.after(1, wait_for_reconnect, (numsec-1))
+                self.after(1000, wait_for_reconnect, (numsec-1))
             else:
+                device_list_frame.forget(device_hash)  # cached firmware properties are stale
                 device_list_frame.refresh()
                 if device_hash in device_list_frame.devices.keys():
                     device_list_frame.select(device_hash)
@@ -699,91 +849,109 @@ class SwitchologyDeviceUpdateFrame(DeviceViewFrame):
                 message=f"The integrity of the firmware file could not be verified.\n"
                         f"Please retry!"
             )
+            finish()
             return
 
-        logging.info("updating firmware on device...")
-        device_hash = self.device.hash
-        self.device.send_command("btl")  # switch to bootloader
-        time.sleep(0.1)
-        self.device.reset()  # reset
-        time.sleep(1)
+        def enter_bootloader(device):
+            # runs on the serial worker, the resets take several seconds
+            device.send_command("btl")  # switch to bootloader
+            time.sleep(0.1)
+            device.reset()  # reset
+            time.sleep(1)
 
-        path_to_dfuutil = os.path.join("dfu-util", "dfu-util.exe")
+        def bootloader_failed(e):
+            logging.error(f"could not switch the device to the bootloader: {e!r}")
+            self.lbl_info.configure(text="Failed!")
+            finish()
 
-        logging.debug(f"running dfutil...")
+        def flash_and_finish(_):
+            try:
+                flash()
+            finally:
+                finish()
 
-        logging.debug(f"dfutil list devices...")
-        self.updateproc = subprocess.Popen(
-            [path_to_dfuutil, "-l"],
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE
-        )
-        listout = self.updateproc.stdout.read().decode()
-        logging.debug(listout)
-        vidpid = None
-        for vp in ["0483:a4f5", "1209:db42"]:
-            if vp in listout:
-                vidpid = vp
-                break
-        if vidpid is None:
-            logging.error(f"did not find any matching DFU device")
-            self.lbl_info.configure(text=f"Failed!")
-            messagebox.showerror(
-                title="Firmware update failed!",
-                message=f"The firmware update failed!"
-                        f"No matching DFU device was found!"
-                        f"Your device should still be on the old version."
-                        f"Please disconnect and reconnect the device!"
-            )
-            return
+        def flash():
+            path_to_dfuutil = os.path.join("dfu-util", "dfu-util.exe")
 
-        logging.debug(f"dfutil updating {vidpid}...")
-        dfuargs = [
-            path_to_dfuutil,
-            "-D", self.firmwarepath.get(),
-            "-d", vidpid,
-        ]
-        self.updateproc = subprocess.Popen(
-            dfuargs,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE
-        )
-        s = ""
-        line = ""
-        for c in iter(lambda: self.updateproc.stdout.read(1), b""):
-            if c.decode() == "\n":
-                logging.debug(line)
-                line=""
-            else:
-                line += c.decode()
-            if c == b'%':
-                v = int(s[-3:]) / 100
-                self.pro_upfw.set(v)
-                self.pro_upfw.update()
-                self.lbl_info.configure(text=f"Updating... {int(v*100)}%")
-            else:
-                s += c.decode()
-        if "DFU state(7) = dfuMANIFEST, status(0) = No error condition is present" in s:
-            logging.info("Firmware update complete!")
-            self.lbl_info.configure(text=f"Complete")
-            messagebox.showinfo(
-                title="Firmware update complete!",
-                message=f"Your device is now on the new version!"
+            logging.debug(f"running dfutil...")
+
+            logging.debug(f"dfutil list devices...")
+            self.updateproc = subprocess.Popen(
+                [path_to_dfuutil, "-l"],
+                stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE
             )
-        else:
-            logging.error(f"Firmware update failed!")
-            self.lbl_info.configure(text=f"Failed!")
-            logging.error(s)
-            messagebox.showerror(
-                title="Firmware update failed!",
-                message=f"The firmware update failed!"
-                        f"Your device should still be on the old version."
-                        f"Please disconnect and reconnect the device!"
+            listout = self.updateproc.stdout.read().decode()
+            logging.debug(listout)
+            vidpid = None
+            for vp in ["0483:a4f5", "1209:db42"]:
+                if vp in listout:
+                    vidpid = vp
+                    break
+            if vidpid is None:
+                logging.error(f"did not find any matching DFU device")
+                self.lbl_info.configure(text=f"Failed!")
+                messagebox.showerror(
+                    title="Firmware update failed!",
+                    message=f"The firmware update failed!"
+                            f"No matching DFU device was found!"
+                            f"Your device should still be on the old version."
+                            f"Please disconnect and reconnect the device!"
+                )
+                return
+
+            logging.debug(f"dfutil updating {vidpid}...")
+            dfuargs = [
+                path_to_dfuutil,
+                "-D", self.firmwarepath.get(),
+                "-d", vidpid,
+            ]
+            self.updateproc = subprocess.Popen(
+                dfuargs,
+                stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE
             )
+            s = ""
+            line = ""
+            for c in iter(lambda: self.updateproc.stdout.read(1), b""):
+                if c.decode() == "\n":
+                    logging.debug(line)
+                    line=""
+                else:
+                    line += c.decode()
+                if c == b'%':
+                    v = int(s[-3:]) / 100
+                    self.pro_upfw.set(v)
+                    self.pro_upfw.update()
+                    self.lbl_info.configure(text=f"Updating... {int(v*100)}%")
+                else:
+                    s += c.decode()
+            if "DFU state(7) = dfuMANIFEST, status(0) = No error condition is present" in s:
+                logging.info("Firmware update complete!")
+                self.lbl_info.configure(text=f"Complete")
+                messagebox.showinfo(
+                    title="Firmware update complete!",
+                    message=f"Your device is now on the new version!"
+                )
+            else:
+                logging.error(f"Firmware update failed!")
+                self.lbl_info.configure(text=f"Failed!")
+                logging.error(s)
+                messagebox.showerror(
+                    title="Firmware update failed!",
+                    message=f"The firmware update failed!"
+                            f"Your device should still be on the old version."
+                            f"Please disconnect and reconnect the device!"
+                )
 
+            device_list_frame.selected_device_hash = None
+            wait_for_reconnect(5)
+
+        logging.info("updating firmware on device...")
+        device_hash = self.device.hash
         device_list_frame = self.master.master.master.device_list_frame
-        device_list_frame.selected_device_hash = None
-        wait_for_reconnect(5)
+        self.lbl_info.configure(text="Switching to bootloader...")
+        then(self.device.submit(enter_bootloader, self.device, timeout=15), flash_and_finish, bootloader_failed)
 
     def update_from_file(self):
         self.pro_upfw['value'] = 0
@@ -805,6 +973,57 @@ class SwitchologyDeviceUpdateFrame(DeviceViewFrame):
         self.update_firmware()
 
 
+# first firmware version supporting each command
+command_versions = {
+    "gfw": semantic_version.Version("0.2.0"),
+    "ghw": semantic_version.Version("0.2.0"),
+    "gbi": semantic_version.Version("0.2.0"),
+    "sbm": semantic_version.Version("0.2.0"),
+    "gbm": semantic_version.Version("0.2.0"),
+    "rst": semantic_version.Version("0.2.0"),
+    "fmt": semantic_version.Version("0.2.0"),
+    "btl": semantic_version.Version("0.3.0"),
+    "gup": semantic_version.Version("0.3.1"),
+    "sup": semantic_version.Version("0.3.1"),
+    "sbf": semantic_version.Version("0.4.0"),
+    "gbf": semantic_version.Version("0.4.0"),
+    "sem": semantic_version.Version("0.4.4"),
+    "gem": semantic_version.Version("0.4.4"),
+    "sdl": semantic_version.Version("0.5.0"),
+    "gdl": semantic_version.Version("0.5.0"),
+    "eol": semantic_version.Version("1.0.0"),
+    "gjs": semantic_version.Version("1.2.0"),
+    "sjs": semantic_version.Version("1.2.0"),
+}
+
+
+def changes_config(command):
+    # setters, factory reset, reset and bootloader make the cached configuration stale
+    name = command.split(" ")[0]
+    return name.startswith("s") or name in ("fmt", "rst", "btl")
+
+
+class CommandResult(NamedTuple):
+    command: str
+    answer: str | None  # None if no answer was read, see error for whether the command was sent
+    ok: bool
+    error: str | None = None
+
+
+class DeviceConfig(NamedTuple):
+    # configuration read from the device in one pass, None where the firmware does not support the getter
+    build_id: str | None
+    hwver: str | None
+    fwver: str | None
+    update_period: int | None
+    base_mode: str | None
+    backlight_factor: int | None
+    module_mode: int | None
+    joystick_deadzone: int | None
+    joystick_saturation: int | None
+    errors: tuple = ()  # (field, error) for every getter that failed
+
+
 class SwitchologyDevice(Device):
     tabs = {
         "View": SwitchologyDeviceViewFrame,
@@ -814,17 +1033,11 @@ class SwitchologyDevice(Device):
 
     def __init__(self, *args):
         super().__init__(*args)
-        self._build_id = None
         self._fw_ver = None
         self._sem_fw_ver = None
-        self._hw_ver = None
-        self._base_mode = None
-        self._update_period = None
-        self._backlight_factor = None
-        self._module_mode = None
-        self._joystick_settings = None
-        self.serial_itf = None
-        self.port = None
+        self._config = None
+        self.serial_session = serial_pool.pool.get(self._hash, self.locate_comport)
+        self.worker = SerialWorker(f"serial-{self._hash}")
         if not (self.vid, self.pid) in [
             (0x0483, 0xA4F5),  # VID & PID assigned to Switchology MCP (starting with firmare v0.4.0)
             (0x0483, 54321),  # compatibility with arbitrary VID and PID for older firmware prior v0.4.0
@@ -833,62 +1046,63 @@ class SwitchologyDevice(Device):
 
     def __del__(self):
         super().__del__()
-        self.close_comport()
+        if hasattr(self, "serial_session"):
+            self.close_comport()
 
-    def open_comport(self):
+    def close(self):
+        super().close()
+        if hasattr(self, "worker"):
+            self.worker.stop()
+        if hasattr(self, "serial_session"):
+            # the pool holds self.locate_comport, the session has to go with the device
+            serial_pool.pool.discard(self._hash, self.serial_session)
+
+    def submit(self, fun, *args, timeout=None):
+        # runs fun(*args) on the device's serial worker thread, see serial_worker.then() for Tk callbacks
+        return self.worker.submit(fun, *args, timeout=timeout)
+
+    def send_command_async(self, command, timeout=None):
+        return self.submit(self.send_command, command, timeout=timeout)
+
+    def send_commands_async(self, commands, check=bool, timeout=None):
+        return self.submit(self.send_commands, list(commands), check, timeout=timeout)
+
+    def config_snapshot_async(self, timeout=10.0):
+        # the firmware version may take retries, hence the longer timeout
+        return self.submit(self.config_snapshot, timeout=timeout)
+
+    def reset_async(self, timeout=10.0):
+        return self.submit(self.reset, timeout=timeout)
+
+    @property
+    def port(self):
+        return self.serial_session.port
+
+    def locate_comport(self):
         logging.debug(f"retrieving comport via swinput...")
         try:
-            self.port = swinput.get_com_port(self._hash)
-            logging.debug(f"found device at \"{self.port}\"")
+            port = swinput.get_com_port(self._hash)
+            logging.debug(f"found device at \"{port}\"")
+            return port
         except RuntimeError:
-            logging.debug(f"looking for device \"{self.serial_number}\"")
-            timout_at = time.thread_time_ns() + 1e9
-            while self.port is None:
-                if time.thread_time_ns() > timout_at:
-                    raise TimeoutError
-                logging.debug("enumerating comports...")
-                for comport in comports():
-                    logging.debug(f"...{comport.serial_number} at {comport.name}")
-                    if comport.serial_number == self.serial_number:
-                        logging.debug(f"found device {comport.serial_number} at {comport.name}!")
-                        self.port = comport.device
-                        break
-
-        timout_at = time.thread_time_ns() + 1e9
-        while self.serial_itf is None:
-            if time.thread_time_ns() > timout_at:
-                raise TimeoutError
-            try:
-                self.serial_itf = serial.Serial(
-                    port=self.port,
-                    baudrate=9600,
-                    bytesize=serial.EIGHTBITS,
-                    parity=serial.PARITY_NONE,
-                    stopbits=serial.STOPBITS_ONE,
-                    xonxoff=False,
-                    rtscts=False,
-                    dsrdtr=False,
-                    timeout=1,
-                )
-                break
-            except Exception as e:
-                logging.debug(e)
+            pass
+        logging.debug(f"looking for device \"{self.serial_number}\"")
+        timeout_at = time.monotonic() + 1
+        while time.monotonic() < timeout_at:
+            logging.debug("enumerating comports...")
+            for comport in comports():
+                logging.debug(f"...{comport.serial_number} at {comport.name}")
+                if comport.serial_number == self.serial_number:
+                    logging.debug(f"found device {comport.serial_number} at {comport.name}!")
+                    return comport.device
+            time.sleep(0.1)
+        raise TimeoutError
 
-        timout_at = time.thread_time_ns() + 1e9
-        while not self.serial_itf.is_open:
-            if time.thread_time_ns() > timout_at:
-                raise TimeoutError
-            try:
-                self.serial_itf.open()
-                self.serial_itf.flush()
-            except Exception as e:
-                logging.debug(e)
-                self.serial_itf.close()
-        return self.serial_itf.is_open
+    def open_comport(self):
+        return self.serial_session.open().is_open
 
     def close_comport(self):
-        if self.serial_itf:
-            self.serial_itf.close()
+        self.serial_session.close()
 
     @property
     def serial_number(self):
@@ -897,78 +1111,163 @@ class SwitchologyDevice(Device):
         return self._serial_number
 
 
+    def supports_command(self, command):
+        if command == "gfw":
+            return True
+        ver = command_versions.get(command.split(" ")[0])
+        return ver is None or ver <= semantic_version.Version(self.fwver.replace("v", ""))
+
     def send_command(self, command):
 
         # basic check if firmware supports the command
-        if command != "gfw":
-            cmd_ver = {
-                "gfw": semantic_version.Version("0.2.0"),
-                "ghw": semantic_version.Version("0.2.0"),
-                "gbi": semantic_version.Version("0.2.0"),
-                "sbm": semantic_version.Version("0.2.0"),
-                "gbm": semantic_version.Version("0.2.0"),
-                "rst": semantic_version.Version("0.2.0"),
-                "fmt": semantic_version.Version("0.2.0"),
-                "btl": semantic_version.Version("0.3.0"),
-                "gup": semantic_version.Version("0.3.1"),
-                "sup": semantic_version.Version("0.3.1"),
-                "sbf": semantic_version.Version("0.4.0"),
-                "gbf": semantic_version.Version("0.4.0"),
-                "sem": semantic_version.Version("0.4.4"),
-                "gem": semantic_version.Version("0.4.4"),
-                "sdl": semantic_version.Version("0.5.0"),
-                "gdl": semantic_version.Version("0.5.0"),
-                "eol": semantic_version.Version("1.0.0"),
-                "gjs": semantic_version.Version("1.2.0"),
-                "sjs": semantic_version.Version("1.2.0"),
-            }
-            ver = cmd_ver.get(command.split(" ")[0])
-            if ver is not None:
-                if ver > semantic_version.Version(self.fwver.replace("v", "")):
-                    logging.debug(f"Command \"{command}\" is not supported by firmware {self.fwver}")
-                    return
-
-        self.open_comport()
+        if not self.supports_command(command):
+            logging.debug(f"Command \"{command}\" is not supported by firmware {self.fwver}")
+            return
+        if changes_config(command):
+            self.invalidate_config()
+
+        def transaction(serial_itf):
+            if command == 'rst':
+                # the device drops off the bus and may come back under another port
+                portstr = serial_itf.portstr
+                self.serial_session.close(forget_port=True)
+                logging.debug(f"interface closed")
+                return f"{portstr} closed"
+            serial_itf.read_until()  # read the command echo
+            return serial_itf.read_until().decode('ascii').strip()
+
         logging.debug(f"sending command \"{command}\"")
-        self.serial_itf.write(f"{command}\r\n".encode('ascii'))
-        if command == 'rst':
-            self.serial_itf.close()
-            logging.debug(f"interface closed")
-            return f"{self.serial_itf.portstr} closed"
-        self.serial_itf.read_until()  # read the command echo
-        ans = self.serial_itf.read_until().decode('ascii').strip()
+        ans = self.serial_session.transact(f"{command}\r\n".encode('ascii'), transaction)
         logging.debug(f"device answered \"{ans}\"")
-        self.close_comport()
         return ans
 
+    def send_commands(self, commands, check=bool, stop_on_failure=True):
+        # writes all commands back to back and parses the echo/answer pairs as they come in, so a batch costs about
+        # one round trip. check(answer) decides whether a command succeeded. Every command gets a result. The device
+        # has received the whole batch, but after the first failure the answers are drained instead of parsed, those
+        # commands are reported as sent and not checked. Read-only batches pass stop_on_failure=False to check
+        # every answer. Commands the firmware does not support are not sent.
+        commands = list(commands)
+        batch = [command for command in commands if self.supports_command(command)]
+        if any(changes_config(command) for command in batch):
+            self.invalidate_config()
+
+        def transaction(serial_itf):
+            batch_results = list()
+            checking = True
+            for command in batch:
+                if not checking:
+                    batch_results.append(CommandResult(command, None, False, "sent, answer not checked"))
+                    continue
+                echo = serial_itf.read_until().decode('ascii').strip()
+                answer = serial_itf.read_until().decode('ascii').strip()
+                logging.debug(f"device answered \"{answer}\" to \"{echo}\"")
+                error = None
+                if command not in echo:
+                    error = f"unexpected echo \"{echo}\""
+                elif not answer:
+                    error = "no answer"
+                elif not check(answer):
+                    error = f"device answered \"{answer}\""
+                batch_results.append(CommandResult(command, answer, error is None, error))
+                if error is not None and stop_on_failure:
+                    checking = False
+            if any(not result.ok for result in batch_results):
+                self.drain_answers(serial_itf)
+            return batch_results
+
+        batch_results = iter(())
+        if batch:
+            logging.debug(f"sending commands {batch}")
+            request = "".join(f"{command}\r\n" for command in batch).encode('ascii')
+            batch_results = iter(self.serial_session.transact(request, transaction))
+        results = list()
+        for command in commands:
+            if command in batch:
+                results.append(next(batch_results))
+            else:
+                results.append(CommandResult(command, None, False, f"not supported by firmware {self.fwver}"))
+        return results
+
+    @staticmethod
+    def drain_answers(serial_itf, timeout=0.2):
+        # discards everything the device still sends, so the next command starts in sync
+        timeout_before = serial_itf.timeout
+        serial_itf.timeout = timeout
+        try:
+            while serial_itf.read_until():
+                pass
+        finally:
+            serial_itf.timeout = timeout_before
+
     def reset(self):
-        self._build_id = None
-        self._fw_ver = None
-        self._hw_ver = None
-        self._base_mode = None
-        self._update_period = None
-        self._backlight_factor = None
+        self.invalidate_config()
         self.send_command("rst")
         time.sleep(5)
 
+    def invalidate_config(self):
+        # after writes, resets and firmware updates; the firmware version is read again as well
+        self._config = None
+        self._fw_ver = None
+        self._sem_fw_ver = None
+
+    @property
+    def cached_config(self):
+        # the last snapshot without talking to the device, None if there is none
+        return self._config
+
+    def config_snapshot(self):
+        # reads all supported getters in one pipelined batch, the result is kept until invalidate_config()
+        if self._config is not None:
+            return self._config
+        fwver = self.fwver
+        getters = ["ghw", "gup", "gbm", "gbf", "gem", "gjs"]
+        if fwver != "v0.4.0":
+            getters.insert(0, "gbi")
+        else:
+            logging.error(f"Will not request build id from firmware v0.4.0 devices!")
+        results = self.send_commands(getters, stop_on_failure=False)
+        answers = {result.command: result.answer for result in results if result.ok}
+        fields = {
+            "gbi": "build id", "ghw": "hardware version", "gup": "update period", "gbm": "base mode",
+            "gbf": "backlight factor", "gem": "module mode", "gjs": "joystick settings",
+        }
+        errors = [(fields[result.command], result.error) for result in results if not result.ok]
+
+        def hex_answer(command):
+            try:
+                return int(answers[command], 16)
+            except (KeyError, ValueError):
+                if command in answers:
+                    errors.append((fields[command], f"invalid answer \"{answers[command]}\""))
+                return None
+
+        joystick_settings = hex_answer("gjs")
+        self._config = DeviceConfig(
+            build_id=answers.get("gbi", "" if fwver == "v0.4.0" else None),
+            hwver=answers.get("ghw"),
+            fwver=fwver,
+            update_period=hex_answer("gup"),
+            base_mode=answers.get("gbm"),
+            backlight_factor=hex_answer("gbf"),
+            module_mode=hex_answer("gem"),
+            joystick_deadzone=None if joystick_settings is None else joystick_settings >> 8,
+            joystick_saturation=None if joystick_settings is None else joystick_settings & 0x00FF,
+            errors=tuple(errors),
+        )
+        return self._config
+
     @property
     def build_id(self):
-        if not self._build_id:
-            if self.fwver == "v0.4.0":
-                logging.error(f"Will not request build id from firmware v0.4.0 devices!")
-                return ""
-            self._build_id = self.send_command('gbi')
-        return self._build_id
+        return self.config_snapshot().build_id
 
     @property
     def hwver(self):
-        if not self._hw_ver:
-            self._hw_ver = self.send_command('ghw')
-        return self._hw_ver
+        return self.config_snapshot().hwver
 
     @property
     def fwver(self):
-        if not self._fw_ver:
+        if self._fw_ver is None:
             for retry in range(3):
                 _fw_ver = self.send_command('gfw')
                 m = re.match("v\d+\.\d+\.\d+(\S*)?", _fw_ver)
@@ -983,41 +1282,27 @@ class SwitchologyDevice(Device):
 
     @property
     def update_period(self):
-        if not self._update_period:
-            self._update_period = int(self.send_command("gup"), 16)
-        return self._update_period
+        return self.config_snapshot().update_period
 
     @property
     def base_mode(self):
-        if not self._base_mode:
-            self._base_mode = self.send_command('gbm')
-        return self._base_mode
+        return self.config_snapshot().base_mode
 
     @property
     def backlight_factor(self):
-        if not self._backlight_factor:
-            self._backlight_factor = int(self.send_command('gbf'), 16)
-        return self._backlight_factor
+        return self.config_snapshot().backlight_factor
 
     @property
     def module_mode(self):
-        if self._sem_fw_ver < semantic_version.Version("0.4.4"):
-            return None
-        if not self._module_mode:
-            self._module_mode = int(self.send_command('gem'), 16)
-        return self._module_mode
+        return self.config_snapshot().module_mode
 
     @property
     def joystick_deadzone(self):
-        if not self._joystick_settings:
-            self._joystick_settings = int(self.send_command("gjs"), 16)
-        return self._joystick_settings >> 8
+        return self.config_snapshot().joystick_deadzone
 
     @property
     def joystick_saturation(self):
-        if not self._joystick_settings:
-            self._joystick_settings = int(self.send_command("gjs"), 16)
-        return self._joystick_settings & 0x00FF
+        return self.config_snapshot().joystick_saturation
 
 
 device_classes[(0x0483, 0xA4F5)] = SwitchologyDevice  # VID & PID assigned to Switchology MCP (starting with firmware v0.4.0)
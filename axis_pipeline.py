@@ -0,0 +1,80 @@
+import numpy as np
+
+AXIS_COUNT = 9
+
+
+class AxisPipeline:
+    # host-side axis processing on all axes of a report at once:
+    # calibration to [-1, 1] using the axis limits, deadzone/saturation, response curve, EMA smoothing
+
+    def __init__(self, axis_min, axis_max):
+        self.axis_min = np.array(axis_min[:AXIS_COUNT], dtype=np.float64)
+        self.axis_max = np.array(axis_max[:AXIS_COUNT], dtype=np.float64)
+        self.deadzone = np.zeros(AXIS_COUNT)
+        self.saturation = np.ones(AXIS_COUNT)
+        self.curve = np.ones(AXIS_COUNT)
+        self.smoothing = np.zeros(AXIS_COUNT)
+        self._state = None
+        self._target = None
+        self._input = None
+        self.calibrate(self.axis_min, self.axis_max)
+
+    def calibrate(self, axis_min, axis_max):
+        self.axis_min[:] = axis_min[:AXIS_COUNT]
+        self.axis_max[:] = axis_max[:AXIS_COUNT]
+        self._center = (self.axis_max + self.axis_min) / 2
+        half_range = (self.axis_max - self.axis_min) / 2
+        self._half_range = np.where(half_range > 0, half_range, 1.0)
+        self.reset()
+
+    def configure(self, axes=None, deadzone=None, saturation=None, curve=None, smoothing=None):
+        # axes selects the axis ids to configure, all axes if None
+        # deadzone and saturation are fractions of the half range, curve is the exponent of the response curve,
+        # smoothing is the weight of the previous output in the EMA (0 disables smoothing)
+        index = slice(None) if axes is None else list(axes)
+        if deadzone is not None:
+            self.deadzone[index] = deadzone
+        if saturation is not None:
+            self.saturation[index] = saturation
+        if curve is not None:
+            self.curve[index] = curve
+        if smoothing is not None:
+            self.smoothing[index] = smoothing
+        np.clip(self.deadzone, 0.0, 0.99, out=self.deadzone)
+        np.maximum(self.saturation, self.deadzone + 0.01, out=self.saturation)
+        np.clip(self.smoothing, 0.0, 0.99, out=self.smoothing)
+        if self._input is not None:
+            # the output moves to the new settings without waiting for the next report
+            self._target = self._shape(self._input)
+
+    def reset(self):
+        self._state = None
+        self._target = None
+        self._input = None
+
+    @property
+    def settled(self):
+        # True once the smoothed output has reached the last input
+        return self._state is None or self._state is self._target
+
+    def _shape(self, values):
+        x = (values - self._center) / self._half_range
+        magnitude = np.clip((np.abs(x) - self.deadzone) / (self.saturation - self.deadzone), 0.0, 1.0)
+        return np.copysign(magnitude ** self.curve, x)
+
+    def process(self, raw=None):
+        # raw is any buffer of int32 axis values, e.g. SWINPUT_DecodedReport.axis. The devices only report changes,
+        # so without a new report raw is None and the smoothing keeps decaying towards the last input
+        if raw is not None:
+            self._input = np.frombuffer(raw, dtype=np.int32, count=AXIS_COUNT).astype(np.float64)
+            self._target = self._shape(self._input)
+        y = self._target
+        if self._state is None:
+            self._state = y
+        else:
+            self._state = self.smoothing * self._state + (1.0 - self.smoothing) * y
+            # less than half a count away from the input, snap to it
+            if np.all(np.abs(self._state - y) * self._half_range < 0.5):
+                self._state = y
+        out = self._center + self._state * self._half_range
+        return np.rint(np.clip(out, self.axis_min, self.axis_max)).astype(np.int32)
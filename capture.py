@@ -0,0 +1,356 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import latency
+import swinput
+
+
+class DrainScheduler:
+
+    def __init__(self, min_interval=0.001, max_interval=0.05, budget=0.005, backoff=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget
+        self.backoff = backoff
+        self.interval = min_interval
+        self._last_ring_used = None
+
+    def update(self, drained, backlog=False, ring_used=None):
+        # returns the time to wait before the next drain
+        rising = ring_used is not None and self._last_ring_used is not None and ring_used > self._last_ring_used
+        if ring_used is not None:
+            self._last_ring_used = ring_used
+        if backlog:
+            self.interval = 0.0
+        elif drained or rising:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, max(self.min_interval, self.interval * self.backoff))
+        return self.interval
+
+
+class CaptureMonitor:
+
+    def __init__(self, interval=1.0, max_buffer_size=16 * 1024 * 1024, min_poll_interval=0.0002, history=60):
+        self.interval = interval
+        self.max_buffer_size = max_buffer_size
+        self.min_poll_interval = min_poll_interval
+        self.samples = deque(maxlen=history)
+        self.stats = None
+        self.overflow_rate = 0.0
+        self.error_rate = 0.0
+        self.fill_ratio = 0.0
+        self.overflows = 0
+        self.resizes = 0
+        self.next_sample = 0.0
+        self._last_time = None
+
+    def due(self, now):
+        return now >= self.next_sample
+
+    def reset(self, stats: swinput.SWINPUT_Stats = None, now=None):
+        # native counters restart together with the capture session, stats is the baseline taken right after it
+        self.stats = stats
+        self._last_time = now
+
+    def sample(self, stats: swinput.SWINPUT_Stats, now):
+        # returns True if the ring overflowed since the previous sample, the first sample is only a baseline
+        self.next_sample = now + self.interval
+        previous = self.stats
+        self.stats = stats
+        last_time = self._last_time
+        self._last_time = now
+        if stats.ring_bytes_capacity:
+            self.fill_ratio = stats.ring_bytes_used_approx / stats.ring_bytes_capacity
+        if previous is None:
+            return False
+        overflows = stats.ring_overflows - previous.ring_overflows
+        errors = stats.rawinput_errors - previous.rawinput_errors
+        if overflows < 0 or errors < 0:  # counters were reset
+            overflows = stats.ring_overflows
+            errors = stats.rawinput_errors
+        self.overflows += overflows
+        if last_time is not None and now > last_time:
+            self.overflow_rate = overflows / (now - last_time)
+            self.error_rate = errors / (now - last_time)
+        self.samples.append((now, self.overflow_rate, self.error_rate, self.fill_ratio))
+        if overflows:
+            logging.warning(f"swinput ring buffer overflowed {overflows} times ({self.overflow_rate:.1f}/s, "
+                            f"{stats.ring_bytes_capacity} bytes)")
+        if errors:
+            logging.debug(f"swinput reported {errors} raw input errors ({self.error_rate:.1f}/s)")
+        return overflows > 0
+
+    def get_counters(self):
+        return {
+            "overflow_rate": self.overflow_rate,
+            "error_rate": self.error_rate,
+            "fill_ratio": self.fill_ratio,
+            "overflows": self.overflows,
+            "resizes": self.resizes,
+        }
+
+
+class CaptureThread(threading.Thread):
+
+    def __init__(self, queue_depth=16, max_reports=256, poll_interval=0.001, buffer_size=1024 * 1024,
+                 monitor=None):
+        super().__init__(name="swinput-capture", daemon=True)
+        self.scheduler = DrainScheduler(min_interval=poll_interval)
+        self.buffer_size = buffer_size
+        self.state = "idle"
+        self.monitor = monitor if monitor is not None else CaptureMonitor()
+        self._filled = queue.Queue(maxsize=queue_depth)
+        self._free = queue.SimpleQueue()
+        # two spare batches: one being filled by the reader, one being consumed
+        for _ in range(queue_depth + 2):
+            self._free.put(swinput.ReportBatch(max_reports))
+        self._stop_event = threading.Event()
+        self._listeners = list()
+        self._taps = list()
+        self._draining = False  # batches are only queued once a consumer drains them
+        self.reports_captured = 0
+        self.batches_captured = 0
+        self.reports_dropped = 0
+        self.batches_dropped = 0
+        self.read_errors = 0
+
+    @property
+    def queue_depth(self):
+        return self._filled.qsize()
+
+    @property
+    def queue_capacity(self):
+        return self._filled.maxsize
+
+    def get_counters(self):
+        return {
+            "reports_captured": self.reports_captured,
+            "batches_captured": self.batches_captured,
+            "reports_dropped": self.reports_dropped,
+            "batches_dropped": self.batches_dropped,
+            "read_errors": self.read_errors,
+            "queue_depth": self.queue_depth,
+            "queue_capacity": self.queue_capacity,
+            "buffer_size": self.buffer_size,
+            "poll_interval": self.scheduler.interval,
+            "state": self.state,
+        } | self.monitor.get_counters()
+
+    def add_listener(self, fun):
+        # fun is called from the capture thread whenever a batch was published
+        self._listeners.append(fun)
+
+    def remove_listener(self, fun):
+        if fun in self._listeners:
+            self._listeners.remove(fun)
+
+    def add_tap(self, fun):
+        # fun(batch) is called from the capture thread with every batch, the batch is recycled after the call
+        self._taps.append(fun)
+
+    def remove_tap(self, fun):
+        if fun in self._taps:
+            self._taps.remove(fun)
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def _drop_oldest(self):
+        try:
+            batch = self._filled.get_nowait()
+        except queue.Empty:
+            return None
+        self.batches_dropped += 1
+        self.reports_dropped += len(batch)
+        return batch
+
+    def _acquire_batch(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            # the consumer is behind, sacrifice the oldest pending batch
+            return self._drop_oldest()
+
+    def _publish(self, batch):
+        while True:
+            try:
+                self._filled.put_nowait(batch)
+                return
+            except queue.Full:
+                dropped = self._drop_oldest()
+                if dropped is not None:
+                    self._free.put(dropped)
+
+    def _read_once(self):
+        batch = self._acquire_batch()
+        if batch is None:
+            return 0
+        try:
+            swinput.read_report_batch(batch)
+        except RuntimeError as e:
+            self.read_errors += 1
+            logging.debug(e)
+            batch.count = 0
+        if len(batch) == 0:
+            self._free.put(batch)
+            return 0
+        self.reports_captured += len(batch)
+        self.batches_captured += 1
+        if latency.tracker is not None:
+            latency.tracker.record_batch("decode", batch)
+        for tap in list(self._taps):
+            tap(batch)
+        if self._draining:
+            self._publish(batch)
+        else:
+            self._free.put(batch)
+        for listener in list(self._listeners):
+            listener()
+        return len(batch)
+
+    def _check_health(self, now):
+        try:
+            stats = swinput.get_stats()
+        except RuntimeError as e:
+            logging.debug(e)
+            self.monitor.next_sample = now + self.monitor.interval
+            return
+        if not self.monitor.sample(stats, now):
+            return
+        self.scheduler.min_interval = max(self.monitor.min_poll_interval, self.scheduler.min_interval / 2)
+        if self.buffer_size < self.monitor.max_buffer_size:
+            self._restart(min(self.monitor.max_buffer_size, self.buffer_size * 2))
+
+    def _restart(self, buffer_size):
+        logging.info(f"restarting capture with a {buffer_size} byte ring buffer")
+        self.state = "restarting"
+        while self._read_once():
+            pass
+        swinput.stop_capture()
+        self.buffer_size = buffer_size
+        self.monitor.resizes += 1
+        swinput.start_capture(buffer_size=self.buffer_size)
+        try:
+            self.monitor.reset(swinput.get_stats(), time.monotonic())
+        except RuntimeError as e:
+            logging.debug(e)
+            self.monitor.reset()
+        self.state = "running"
+
+    def _drain_ring(self):
+        # drains the native ring until it is empty or the time budget is used up
+        deadline = time.perf_counter() + self.scheduler.budget
+        drained = 0
+        while True:
+            count = self._read_once()
+            drained += count
+            if count == 0:
+                return drained, False
+            if time.perf_counter() >= deadline:
+                return drained, True
+
+    def run(self):
+        swinput.start_capture(buffer_size=self.buffer_size)
+        self.state = "running"
+        try:
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                if self.monitor.due(now):
+                    self._check_health(now)
+                drained, backlog = self._drain_ring()
+                ring_used = None
+                if not backlog:
+                    try:
+                        ring_used = swinput.get_stats().ring_bytes_used_approx
+                    except RuntimeError:
+                        pass
+                interval = self.scheduler.update(drained, backlog, ring_used)
+                if interval > 0:
+                    self._stop_event.wait(interval)
+        finally:
+            self.state = "stopped"
+            try:
+                swinput.stop_capture()
+            except RuntimeError:
+                pass
+
+    def batches(self):
+        # yields pending batches oldest first; each batch is recycled once the consumer moves on
+        self._draining = True
+        while True:
+            try:
+                batch = self._filled.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                yield batch
+            finally:
+                self._free.put(batch)
+
+    def drain(self, handle_report, budget=None):
+        # hands pending reports to handle_report until the queue is empty or the time budget is used up
+        self._draining = True
+        deadline = None if budget is None else time.perf_counter() + budget
+        count = 0
+        while True:
+            try:
+                batch = self._filled.get_nowait()
+            except queue.Empty:
+                return count, False
+            try:
+                for report in batch:
+                    handle_report(report)
+                count += len(batch)
+            finally:
+                self._free.put(batch)
+            if deadline is not None and time.perf_counter() >= deadline:
+                return count, self._filled.qsize() > 0
+
+    def reports(self):
+        for batch in self.batches():
+            yield from batch
+
+
+# the native side has a single capture session, every consumer in the process shares one capture thread
+_shared = None
+_shared_users = 0
+_shared_lock = threading.Lock()
+
+
+def acquire_capture(drain=False, tap=None, **kwargs):
+    # returns the running process-wide capture thread, kwargs only apply when it is created.
+    # drain=True queues batches from now on for a consumer of drain() or batches(), a tap is added before
+    # the first batch is read
+    global _shared, _shared_users
+    with _shared_lock:
+        capture = _shared
+        if capture is None:
+            capture = CaptureThread(**kwargs)
+        if drain:
+            capture._draining = True
+        if tap is not None:
+            capture.add_tap(tap)
+        if _shared is None:
+            _shared = capture
+            capture.start()
+        _shared_users += 1
+        return capture
+
+
+def release_capture(capture):
+    # the capture thread and the native session stop with the last user
+    global _shared, _shared_users
+    with _shared_lock:
+        if capture is not _shared:
+            return
+        _shared_users -= 1
+        if _shared_users > 0:
+            return
+        _shared = None
+    capture.stop()
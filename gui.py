@@ -1,14 +1,20 @@
 import json
 import os
 import sys
+from collections import deque
 from tkinter import filedialog, messagebox
 import logging
 import argparse
 import customtkinter
-from Device import Device, device_classes
+from Device import Device, DeviceRegistry, DeviceViewFrame, device_classes
 from Switchology import SwitchologyDevice, NotSwitchologyDeviceError, NoSerialNumberError
 
+import latency
+import serial_pool
+import serial_worker
 import swinput
+from capture import DrainScheduler, acquire_capture, release_capture
+from recording import RecordingFormatError, SessionRecorder, SessionPlayer
 
 from updater import check_for_update, update
 
@@ -17,55 +23,76 @@ try:
 except ModuleNotFoundError:
     gitrev = "unknown version"
 
-appdata_path = os.path.join(os.getenv('APPDATA'), 'sw_app')
+appdata_path = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'sw_app')
 
 
 class LogHandler(logging.Handler):
-    def __init__(self, textwidget: customtkinter.CTkTextbox):
+    # records from any thread are queued and written to the textbox in batches on a Tk timer,
+    # the textbox keeps only the last max_lines lines
+
+    def __init__(self, textwidget: customtkinter.CTkTextbox, interval=100, max_lines=1000):
         super().__init__()
         self.textwidget = textwidget
+        self.interval = interval
+        self.max_lines = max_lines
+        self.pending = deque(maxlen=max_lines)
+        self.textwidget.after(self.interval, self.flush_pending)
 
     def emit(self, record):
-        self.textwidget.configure(state="normal")
-        self.textwidget.insert("end", self.format(record) + '\n')
-        self.textwidget.yview("end")
-        self.textwidget.update()
-        self.textwidget.configure(state="disabled")
-
-
-def get_devices():
-    logging.debug("Enumerating HID Devices...")
-
-    devices = dict()
-    device_infos = swinput.enumerate_devices()
-    for device_info in device_infos:
-
-
-        description_string = \
-            f"Hash: {device_info.device_hash}\n" \
-            f"\tManufacturer: \"{device_info.manufacturer}\"\n" \
-            f"\tProductName: \"{device_info.product_name}\"\n" \
-            f"\tSerial Number: \"{device_info.serial_number}\"\n" \
-            f"\tHID-Path: \"{device_info.hid_path}\"\n" \
-            f"\tVID: \"0x{device_info.vid:04X}\"\n" \
-            f"\tPID: \"0x{device_info.pid:04X}\"\n" \
-            f"\tUsagePage: \"0x{device_info.usage_page:04X}\"\n" \
-            f"\tUsage: \"0x{device_info.usage:04X}\"\n"
-
         try:
-            comport = swinput.get_com_port(device_info.device_hash)
-            description_string += f"\tCOM-Port: \"{comport}\""
-        except RuntimeError as e:
-            pass  # no COM port found
-        logging.debug(description_string)
-        temp_device_class = device_classes.get((device_info.vid, device_info.pid), Device)
-        if temp_device_class != SwitchologyDevice:
-            continue
-        devices[device_info.device_hash] = temp_device_class(device_info)
-
-    logging.debug("Enumeration of HID Devices completed!")
-    return devices
-
+            self.pending.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def flush_pending(self):
+        lines = list()
+        while self.pending:
+            lines.append(self.pending.popleft())
+        if lines:
+            self.textwidget.configure(state="normal")
+            self.textwidget.insert("end", "\n".join(lines) + "\n")
+            # records may span several lines, so trim by the text lines of the widget, the last one is empty
+            line_count = int(self.textwidget.index("end-1c").split(".")[0]) - 1
+            if line_count > self.max_lines:
+                self.textwidget.delete("1.0", f"{line_count - self.max_lines + 1}.0")
+            self.textwidget.yview("end")
+            self.textwidget.configure(state="disabled")
+        self.textwidget.after(self.interval, self.flush_pending)
+
+
+def describe_device(device_info):
+    description_string = \
+        f"Hash: {device_info.device_hash}\n" \
+        f"\tManufacturer: \"{device_info.manufacturer}\"\n" \
+        f"\tProductName: \"{device_info.product_name}\"\n" \
+        f"\tSerial Number: \"{device_info.serial_number}\"\n" \
+        f"\tHID-Path: \"{device_info.hid_path}\"\n" \
+        f"\tVID: \"0x{device_info.vid:04X}\"\n" \
+        f"\tPID: \"0x{device_info.pid:04X}\"\n" \
+        f"\tUsagePage: \"0x{device_info.usage_page:04X}\"\n" \
+        f"\tUsage: \"0x{device_info.usage:04X}\"\n"
+
+    try:
+        comport = swinput.get_com_port(device_info.device_hash)
+        description_string += f"\tCOM-Port: \"{comport}\""
+    except RuntimeError as e:
+        pass  # no COM port found
+    return description_string
+
+
+def create_device(device_info):
+    # called once per newly connected HID device
+    if logging.root.level <= logging.DEBUG:  # describe_device looks up the COM port, only pay for it when debugging
+        logging.debug(describe_device(device_info))
+    temp_device_class = device_classes.get((device_info.vid, device_info.pid), Device)
+    if temp_device_class != SwitchologyDevice:
+        return None
+    return temp_device_class(device_info)
+
+
+def create_replay_device(device_info):
+    # recorded devices are usually not connected, so they are replayed into the generic device model
+    return Device(device_info)
 
 
 class GUI(customtkinter.CTk):
@@ -75,24 +102,36 @@ class GUI(customtkinter.CTk):
         logging.getLogger().setLevel(logging.getLevelNamesMapping().get(self.var_llvl.get(), 'INFO'))
 
     def change_device_frame(self, device_hash):
-        self.device_tabview.destroy()
-        self.device_tabview = customtkinter.CTkTabview(self, width=600, height=550)
-        if self.device_list_frame is None:
-            return
-        if device_hash is None:
-            return
-        for tabname in self.device_list_frame.devices[device_hash].tabs.keys():
-            tab = self.device_tabview.add(tabname)
-            tabframe = self.device_list_frame.devices[device_hash].tabs[tabname](tab, width=600, height=550)
-            tabframe.grid(row=0, column=1, sticky="nsew", padx=5, pady=5)
-            try:
-                tabframe.refresh(self.device_list_frame.devices[device_hash])
-            except Exception as e:
-                logging.error(e)
-                continue
+        # tab views are kept per device hash, only tabs that were shown before are refreshed on reselection
+        if isinstance(self.device_tabview, DeviceTabview):
+            self.device_tabview.detach()
+        self.device_tabview.grid_remove()
+        self.device_tabview = self.empty_tabview
+        if self.device_list_frame is not None and device_hash is not None:
+            device = self.device_list_frame.devices[device_hash]
+            tabview = self.device_tabviews.get(device_hash)
+            if tabview is not None and tabview.device is not device:
+                self.invalidate_device_frame(device_hash)
+                tabview = None
+            if tabview is None:
+                tabview = DeviceTabview(self, device, width=600, height=550)
+                self.device_tabviews[device_hash] = tabview
+            else:
+                tabview.refresh_live_tabs()
+            tabview.show_current()
+            self.device_tabview = tabview
         self.device_tabview.grid(row=0, column=1, sticky="nsew", padx=5, pady=5)
 
-    def __init__(self, **kwargs):
+    def invalidate_device_frame(self, device_hash):
+        tabview = self.device_tabviews.pop(device_hash, None)
+        if tabview is None:
+            return
+        if tabview is self.device_tabview:
+            self.device_tabview = self.empty_tabview
+            self.device_tabview.grid(row=0, column=1, sticky="nsew", padx=5, pady=5)
+        tabview.destroy()
+
+    def __init__(self, record_path=None, replay_path=None, replay_speed=1.0, **kwargs):
         super().__init__(**kwargs)
 
         latest_version = check_for_update()
@@ -107,15 +146,20 @@ class GUI(customtkinter.CTk):
                 update()
 
         self.device_list_frame = None
+        serial_worker.install(self)  # results of the device serial workers are delivered on the Tk thread
 
         if not os.path.exists(appdata_path):
             os.makedirs(appdata_path)
 
-        self.device_tabview = customtkinter.CTkTabview(self, width=600, height=550)
+        self.device_tabviews = dict()
+        self.empty_tabview = customtkinter.CTkTabview(self, width=600, height=550)
+        self.device_tabview = self.empty_tabview
         self.device_tabview.grid(row=0, column=1, sticky="nsew", padx=5, pady=5)
 
-        self.device_list_frame = DeviceListFrame(self, command=self.change_device_frame, width=200,
-                                                 height=550)
+        self.device_list_frame = DeviceListFrame(self, command=self.change_device_frame,
+                                                 on_remove=self.invalidate_device_frame, width=200,
+                                                 height=550, record_path=record_path, replay_path=replay_path,
+                                                 replay_speed=replay_speed)
         self.device_list_frame.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
 
         self.bindings_frame = customtkinter.CTkFrame(self, width=300, height=550)  # reset to BindingsFrame when DCS code issue is solved
@@ -128,54 +172,141 @@ class GUI(customtkinter.CTk):
         self.grid_rowconfigure(0, weight=1)
 
 
+class DeviceTabview(customtkinter.CTkTabview):
+    # the tabs of one device, each tab frame is built and refreshed when the tab is shown the first time
+
+    def __init__(self, master, device, **kwargs):
+        super().__init__(master, command=self.show_current, **kwargs)
+        self.device = device
+        self.tabframes = dict()
+        for tabname in device.tabs.keys():
+            self.add(tabname)
+
+    def show_current(self):
+        tabname = self.get()
+        if not tabname or tabname in self.tabframes:
+            return
+        tabframe = self.device.tabs[tabname](self.tab(tabname), width=600, height=550)
+        tabframe.grid(row=0, column=1, sticky="nsew", padx=5, pady=5)
+        self.tabframes[tabname] = tabframe
+        try:
+            tabframe.refresh(self.device)
+        except Exception as e:
+            logging.error(e)
+
+    def refresh_live_tabs(self):
+        # tabs showing live input lose their subscriptions while the device is not selected
+        for tabframe in self.tabframes.values():
+            if tabframe.refresh_on_show:
+                try:
+                    tabframe.refresh(self.device)
+                except Exception as e:
+                    logging.error(e)
+
+    def detach(self):
+        for tabframe in self.tabframes.values():
+            tabframe.detach()
+
+    def destroy(self):
+        self.detach()
+        super().destroy()
+
+
 class DeviceListFrame(customtkinter.CTkFrame):
 
-    def __init__(self, master: GUI, command=None, **kwargs):
+    def __init__(self, master: GUI, command=None, on_remove=None, record_path=None, replay_path=None, replay_speed=1.0, **kwargs):
         self._sb_selected_color = customtkinter.ThemeManager.theme["CTkSegmentedButton"]["selected_color"]
         self._sb_selected_hover_color = customtkinter.ThemeManager.theme["CTkSegmentedButton"]["selected_hover_color"]
         self._sb_unselected_color = customtkinter.ThemeManager.theme["CTkSegmentedButton"]["unselected_color"]
         self._sb_unselected_hover_color = customtkinter.ThemeManager.theme["CTkSegmentedButton"]["unselected_hover_color"]
         super().__init__(master, **kwargs)
         self._command = command
+        self._on_remove = on_remove
         self.device_buttons = dict()
-        self.devices = get_devices()
+        self.recorder = None
+        self.player = None
+        self.replay_cursor = None
+        if replay_path:
+            self.player = SessionPlayer(replay_path)
+            self.replay_cursor = self.player.cursor(replay_speed)
+            logging.info(f"replaying \"{replay_path}\" ({len(self.player)} reports, {self.player.duration:.1f}s)")
+        if self.player is not None:
+            self.registry = DeviceRegistry(create_replay_device, lambda: self.player.device_infos)
+        else:
+            self.registry = DeviceRegistry(create_device)
+        self.devices = self.registry.devices
+        self.selected_device_hash = None
+        self._devices_known = None
         refresh_button = customtkinter.CTkButton(self, text="Refresh List", command=self.refresh)
         refresh_button.grid(pady=5, padx=5, sticky="ew")
         self.refresh()
-        self.selected_device_hash = None
+
+        # the Tk side backs off to 20 Hz while idle and runs at up to 120 Hz while reports are flowing
+        self.drain_scheduler = DrainScheduler(min_interval=1 / 120, max_interval=1 / 20, budget=0.008)
+        self.capture = None
+        if self.player is None:
+            self.capture = acquire_capture(drain=True)
+            if record_path:
+                self.recorder = SessionRecorder(record_path, swinput.enumerate_devices())
+                logging.info(f"recording to \"{record_path}\"")
 
         self.after(100, self.dispatch_device_events)
         self.after(100, self.select_device_at_start)
+        if self.player is None:
+            self.after(500, self.watch_hotplug)
 
     def __del__(self):
-        swinput.stop_capture()
+        self.close()
+
+    def close(self):
+        if self.capture is not None:
+            release_capture(self.capture)
+            self.capture = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.player is not None:
+            self.player.close()
+            self.player = None
 
     def select_device_at_start(self):
-        if len(self.devices) > 0:
-            self.select(list(self.devices.keys())[0])
+        if len(self.device_buttons) > 0:
+            self.select(list(self.device_buttons.keys())[0])
 
     def dispatch_device_events(self):
-        if self.selected_device_hash is None:
-            try:
-                swinput.stop_capture()
-            except RuntimeError:
-                pass
-        else:
-            swinput.start_capture()
-            for this_report in swinput.read_reports(256):
-                if this_report.device_hash not in self.devices:
-                    continue
-                if this_report.button_count > 0:
-                    for i in range(this_report.button_count):
-                        this_button = this_report.buttons[int(i / 32)] & (1 << (i % 32))
-                        self.devices[this_report.device_hash].update_button(i, this_button != 0)
-
-                if this_report.axis_present:
-                    for axis_id in range(9):
-                        if this_report.axis_present & (1 << axis_id):
-                            self.devices[this_report.device_hash].update_axis(axis_id, this_report.axis[axis_id])
-        self.after(int(1000 / 60), self.dispatch_device_events)
-
+        # change set subscribers get one per device and frame, however many reports arrived,
+        # replays take the same path so they can be used for profiling
+        for device in self.devices.values():
+            device.begin_changes()
+        try:
+            if self.replay_cursor is not None:
+                drained = 0
+                for this_report in self.replay_cursor.due(max_reports=4096):
+                    self.dispatch_report(this_report)
+                    drained += 1
+                backlog = drained == 4096
+            elif self.recorder is not None:
+                drained, backlog = self.capture.drain(self.record_and_dispatch_report, self.drain_scheduler.budget)
+            else:
+                drained, backlog = self.capture.drain(self.dispatch_report, self.drain_scheduler.budget)
+        finally:
+            for device in self.devices.values():
+                device.settle_axes()
+                device.end_changes()
+        interval = self.drain_scheduler.update(drained, backlog)
+        self.after(max(1, int(interval * 1000)), self.dispatch_device_events)
+
+    def record_and_dispatch_report(self, this_report):
+        self.recorder.write(this_report)
+        self.dispatch_report(this_report)
+
+    def dispatch_report(self, this_report):
+        # every known device is kept up to date, not only the selected one
+        if latency.tracker is not None:
+            latency.tracker.record("dispatch", this_report.qpc)
+        device = self.devices.get(this_report.device_hash)
+        if device is not None:
+            device.update_report(this_report)
 
     def select(self, device_hash):
         if len(self.device_buttons) == 0:
@@ -185,7 +316,6 @@ class DeviceListFrame(customtkinter.CTkFrame):
                 fg_color=self._sb_unselected_color,
                 hover_color=self._sb_unselected_hover_color
             )
-            self.devices[self.selected_device_hash].close()
         self.selected_device_hash = device_hash
         self.device_buttons[self.selected_device_hash].configure(
             fg_color=self._sb_selected_color,
@@ -193,21 +323,66 @@ class DeviceListFrame(customtkinter.CTkFrame):
         )
         if self._command:
             self._command(self.selected_device_hash)
+        device = self.devices[device_hash]
+        self.update_device_button(device)
+        if hasattr(device, "config_snapshot_async") and device.cached_config is None:
+            # the snapshot is cached, the views requesting it as well costs nothing extra
+            serial_worker.then(device.config_snapshot_async(), lambda config: self.update_device_button(device),
+                               lambda e: logging.debug(f"no configuration for the button of {device}: {e!r}"))
+
+    def update_device_button(self, device):
+        button = self.device_buttons.get(device.hash)
+        if button is not None and self.devices.get(device.hash) is device:
+            button.configure(text=self.device_button_text(device))
+
+    @staticmethod
+    def device_button_text(device):
+        lines = [device.product_name, device.serial_number, str(device.hash)]
+        config = getattr(device, "cached_config", None)  # never reads from the device
+        if config is not None and config.fwver:
+            lines.append(f"Firmware {config.fwver}")
+        return "\n".join(lines)
+
+    def watch_hotplug(self):
+        # the native side counts the devices it knows of, a change means something was plugged or unplugged
+        try:
+            devices_known = swinput.get_stats().devices_known
+        except RuntimeError:
+            devices_known = None
+        if devices_known is not None and devices_known != self._devices_known:
+            if self._devices_known is not None:
+                logging.debug(f"device count changed from {self._devices_known} to {devices_known}")
+                self.refresh()
+            self._devices_known = devices_known
+        self.after(500, self.watch_hotplug)
+
+    def forget(self, device_hash):
+        self.registry.forget(device_hash)
+        self.remove_device_button(device_hash)
+
+    def remove_device_button(self, device_hash):
+        button = self.device_buttons.pop(device_hash, None)
+        if button is not None:
+            button.destroy()
+        if self._on_remove:
+            self._on_remove(device_hash)
+        if device_hash == self.selected_device_hash:
+            self.selected_device_hash = None
+            if self._command:
+                self._command(self.selected_device_hash)
 
     def refresh(self):
-        self.selected_device_hash = None
-        self.devices.clear()
-        if self._command:
-            self._command(self.selected_device_hash)
-        self.devices = get_devices()
-        for device_button in self.device_buttons.values():
-            device_button.destroy()
-        for i, (device_hash, device) in enumerate(self.devices.items()):
+        logging.debug("Enumerating HID Devices...")
+        added, removed = self.registry.update()
+        logging.debug(f"Enumeration of HID Devices completed! {len(added)} added, {len(removed)} removed")
+        for device_hash in removed:
+            self.remove_device_button(device_hash)
+        for device_hash in added:
+            device = self.devices[device_hash]
             try:
-                btn_text = "\n".join([device.product_name, device.serial_number, str(device.hash)])
                 button = customtkinter.CTkButton(
                     self,
-                    text=btn_text,
+                    text=self.device_button_text(device),
                     command=lambda x=device.hash: self.select(x),
                     fg_color=self._sb_unselected_color,
                     hover_color=self._sb_unselected_hover_color
@@ -259,8 +434,22 @@ def main():
     )
     parser.add_argument('-d', '--debug', action='store_true', help='set loglevel to DEBUG')
     parser.add_argument('--logfile')
+    parser.add_argument('--record', metavar='FILE', help='record all captured reports to FILE')
+    parser.add_argument('--replay', metavar='FILE', help='replay a recorded session instead of capturing')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='replay speed factor, 0 for maximum speed')
+    parser.add_argument('--max-fps', type=int, default=DeviceViewFrame.max_fps,
+                        help='maximum redraw rate of the device view, 0 for no limit')
+    parser.add_argument('--latency', action='store_true',
+                        help='measure input latency from capture to canvas, F12 dumps the summary')
 
     args = parser.parse_args()
+    if args.max_fps < 0:
+        parser.error("--max-fps must not be negative")
+    if args.replay:
+        try:
+            SessionPlayer(args.replay).close()
+        except (OSError, RecordingFormatError) as e:
+            parser.error(f"cannot replay \"{args.replay}\": {e}")
 
     if args.debug:
         loglevel = logging.DEBUG
@@ -286,15 +475,30 @@ def main():
     params_string = ', '.join([f'{argname}={argval}' for argname, argval in vars(args).items()])
     logging.info(f"Switchology Cockpit Companion {gitrev} launched with parameters {params_string}")
 
-    gui = GUI()
+    DeviceViewFrame.max_fps = args.max_fps
+    gui = GUI(record_path=args.record, replay_path=args.replay, replay_speed=args.replay_speed)
     gui.title(f"Switchology Cockpit Companion {gitrev}")
     gui.wm_iconbitmap("res/icon.ico")
     # gui.geometry("1000x600")
     lh = LogHandler(gui.txt_logs)
     logging.getLogger().addHandler(lh)
 
+    latency_path = os.path.join(appdata_path, "latency.json")
+    if args.latency:
+        if args.replay:
+            # recorded timestamps are not comparable to the current clock
+            logging.warning("latency measurement is not available while replaying")
+        else:
+            latency.enable(swinput.get_qpc_frequency())
+            gui.bind("<F12>", lambda event: latency.tracker.dump(latency_path))
+
     logging.info("Program start")
     gui.mainloop()
+    gui.device_list_frame.close()
+    serial_pool.pool.close_all()
+    if latency.tracker is not None:
+        logging.info(f"input latency:\n{latency.tracker.summary_text()}")
+        latency.tracker.dump(latency_path)
 
 
 if __name__ == "__main__":
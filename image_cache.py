@@ -0,0 +1,169 @@
+import json
+import os
+from collections import OrderedDict
+
+from PIL import Image, ImageTk
+
+ATLAS_DIR = os.path.join("res", "atlas")
+ATLAS_SCALES = (1.0, 1.25, 1.5, 1.75, 2.0)  # customtkinter widget scalings of common DPI settings
+ATLAS_ROTATIONS = (0, 90, 180, 270)
+ATLAS_WIDTH = 2048
+
+
+def atlas_name(imgdir, scale):
+    return f"{os.path.basename(os.path.normpath(imgdir))}@{scale:g}"
+
+
+def build_atlas(imgdir, scale, subsample, outdir=ATLAS_DIR):
+    # pre-renders every image of imgdir at the given scale in all rotations into one sprite sheet
+    # <name>.png and an index <name>.json of {filename: {rotation: [x, y, width, height]}}
+    sprites = list()
+    for filename in sorted(os.listdir(imgdir)):
+        filepath = os.path.join(imgdir, filename)
+        if not os.path.isfile(filepath) or not filename.lower().endswith(".png"):
+            continue
+        with Image.open(filepath) as source:
+            im = source.convert("RGBA").resize((
+                int(source.width / subsample * scale),
+                int(source.height / subsample * scale),
+            ))
+        for rotation in ATLAS_ROTATIONS:
+            sprites.append((filename.lower(), rotation, im.rotate(rotation, expand=1) if rotation else im))
+
+    # shelf packing, tallest sprites first
+    sprites.sort(key=lambda sprite: sprite[2].height, reverse=True)
+    boxes = list()
+    x = y = shelf_height = 0
+    for filename, rotation, im in sprites:
+        if x + im.width > ATLAS_WIDTH:
+            x = 0
+            y += shelf_height
+            shelf_height = 0
+        boxes.append((x, y))
+        x += im.width
+        shelf_height = max(shelf_height, im.height)
+
+    sheet = Image.new("RGBA", (ATLAS_WIDTH, max(1, y + shelf_height)))
+    index = {"scale": scale, "subsample": subsample, "sprites": dict()}
+    for (filename, rotation, im), (x, y) in zip(sprites, boxes):
+        sheet.paste(im, (x, y))
+        index["sprites"].setdefault(filename, dict())[str(rotation)] = [x, y, im.width, im.height]
+
+    os.makedirs(outdir, exist_ok=True)
+    name = atlas_name(imgdir, scale)
+    sheet.save(os.path.join(outdir, f"{name}.png"), optimize=True)
+    with open(os.path.join(outdir, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+    return name
+
+
+class SpriteAtlas:
+
+    def __init__(self, path):
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.scale = index["scale"]
+        self.subsample = index["subsample"]
+        self.sprites = index["sprites"]
+        self._path = f"{path}.png"
+        self._sheet = None
+
+    def get_image(self, filename, rotation=0):
+        box = self.sprites.get(filename.lower(), dict()).get(str(rotation))
+        if box is None:
+            return None
+        if self._sheet is None:
+            self._sheet = Image.open(self._path)
+            self._sheet.load()
+        x, y, width, height = box
+        return self._sheet.crop((x, y, x + width, y + height))
+
+
+class ImageCache:
+    # decoded and resized PIL images and their rotated PhotoImages, shared by all views,
+    # keyed by (asset path, scale, subsample, rotation) and evicted least recently used first
+
+    def __init__(self, max_images=128, max_photos=128, atlas_dir=ATLAS_DIR):
+        self.max_images = max_images
+        self.max_photos = max_photos
+        self.atlas_dir = atlas_dir
+        self._images = OrderedDict()
+        self._photos = OrderedDict()
+        self._atlases = dict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _lookup(entries, key):
+        entry = entries.get(key)
+        if entry is not None:
+            entries.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def _store(entries, key, entry, max_entries):
+        entries[key] = entry
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+        return entry
+
+    def get_atlas(self, imgdir, scale, subsample):
+        # the pre-rendered atlas of imgdir at this scale, None if the build did not produce one
+        key = (imgdir, scale, subsample)
+        if key not in self._atlases:
+            path = os.path.join(self.atlas_dir, atlas_name(imgdir, scale))
+            atlas = None
+            if os.path.isfile(f"{path}.json"):
+                atlas = SpriteAtlas(path)
+                if atlas.subsample != subsample:
+                    atlas = None
+            self._atlases[key] = atlas
+        return self._atlases[key]
+
+    def get_image(self, path, scale=1.0, subsample=1.0, rotation=0):
+        # returns None if there is no such asset
+        key = (path, scale, subsample, rotation)
+        im = self._lookup(self._images, key)
+        if im is not None:
+            self.hits += 1
+            return im
+        self.misses += 1
+        atlas = self.get_atlas(os.path.dirname(path), scale, subsample)
+        if atlas is not None:
+            im = atlas.get_image(os.path.basename(path), rotation)
+            if im is not None:
+                return self._store(self._images, key, im, self.max_images)
+        if rotation:
+            im = self.get_image(path, scale, subsample)
+            if im is None:
+                return None
+            im = im.rotate(rotation, expand=1)
+        else:
+            if not os.path.isfile(path):
+                return None
+            with Image.open(path) as source:
+                im = source.resize((
+                    int(source.width / subsample * scale),
+                    int(source.height / subsample * scale),
+                ))
+        return self._store(self._images, key, im, self.max_images)
+
+    def get_photo(self, path, scale=1.0, subsample=1.0, rotation=0):
+        # needs a Tk root, the caller has to keep a reference while the image is displayed
+        key = (path, scale, subsample, rotation)
+        photo = self._lookup(self._photos, key)
+        if photo is not None:
+            self.hits += 1
+            return photo
+        im = self.get_image(path, scale, subsample, rotation)
+        if im is None:
+            return None
+        return self._store(self._photos, key, ImageTk.PhotoImage(im), self.max_photos)
+
+    def clear(self):
+        self._images.clear()
+        self._photos.clear()
+        self._atlases.clear()
+
+
+cache = ImageCache()
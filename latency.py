@@ -0,0 +1,105 @@
+import json
+import logging
+import time
+
+# pipeline stages, each measured from the native capture timestamp (qpc) of a report
+STAGES = ("decode", "dispatch", "model", "canvas")
+
+
+class LatencyHistogram:
+    # bucket i holds latencies below 2**i microseconds
+
+    def __init__(self, bucket_count=32):
+        self.buckets = [0] * bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds < 0:
+            seconds = 0.0
+        us = int(seconds * 1e6)
+        self.buckets[min(len(self.buckets) - 1, us.bit_length())] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # upper bound of the bucket containing the p-th percentile, in seconds
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.mean * 1e3,
+            "p50_ms": self.percentile(50) * 1e3,
+            "p90_ms": self.percentile(90) * 1e3,
+            "p99_ms": self.percentile(99) * 1e3,
+            "max_ms": self.max * 1e3,
+        }
+
+
+class LatencyTracker:
+
+    def __init__(self, qpc_frequency):
+        self.qpc_frequency = qpc_frequency
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+    def record(self, stage, qpc, now=None):
+        # qpc shares its time base with time.perf_counter() on every backend
+        if not qpc:
+            return
+        if now is None:
+            now = time.perf_counter()
+        self.histograms[stage].add(now - qpc / self.qpc_frequency)
+
+    def record_batch(self, stage, batch, now=None):
+        if now is None:
+            now = time.perf_counter()
+        for report in batch:
+            self.record(stage, report.qpc, now)
+
+    def reset(self):
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+    def summary(self):
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def summary_text(self):
+        lines = list()
+        for stage, s in self.summary().items():
+            lines.append(f"{stage:>8}: n={s['count']} p50<{s['p50_ms']:.2f}ms p99<{s['p99_ms']:.2f}ms "
+                         f"max={s['max_ms']:.2f}ms")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        logging.info(f"latency summary written to \"{path}\"")
+
+
+tracker = None
+
+
+def enable(qpc_frequency):
+    global tracker
+    tracker = LatencyTracker(qpc_frequency)
+    return tracker
+
+
+def disable():
+    global tracker
+    tracker = None
@@ -10,6 +10,14 @@ import tkinter
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 
+from image_cache import ATLAS_DIR, ATLAS_SCALES, build_atlas
+
+# image directory, scales and subsample of the module artwork drawn by the view frames
+atlases = [
+    (os.path.join("res", "modimgs", "prototype_v_0_4"), ATLAS_SCALES, 3.556),  # SwitchologyDeviceViewFrame
+    (os.path.join("res", "modimgs", "prototype_v_0_2"), (1.0,), 3.556),  # SwitchologyAlphaDeviceViewRame
+]
+
 def cmd(c):
     print(c)
     p = subprocess.run(c, shell=True, capture_output=True)
@@ -25,6 +33,12 @@ def sha256_file(path):
     return h.hexdigest()
 
 
+def build_atlases(outdir=ATLAS_DIR):
+    for imgdir, scales, subsample in atlases:
+        for scale in scales:
+            print(f"Rendering sprite atlas {build_atlas(imgdir, scale, subsample, outdir)}...")
+
+
 def main():
     load_dotenv()
 
@@ -99,6 +113,9 @@ def main():
         else:
             cmd(f"xcopy \"{item_path}\" \"{staging_path}\\*\"")
 
+    # pre-render module artwork
+    build_atlases(os.path.join(staging_path, ATLAS_DIR))
+
     # install requirements
     print("Installing requirements...")
     cmd(f"{python_path} -m pip install -r {os.path.join(staging_path, 'requirements.txt')}")
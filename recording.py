@@ -0,0 +1,263 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+
+import swinput
+
+MAGIC = b"SWRC"
+VERSION = 1
+INDEX_STRIDE = 1024  # one seek index entry every INDEX_STRIDE records
+
+# magic, version, record size, device table size, qpc frequency, record count, index offset, index count
+_header = struct.Struct("<4sHHIQQQQ")
+# device_hash, qpc, button_count, buttons[8], axis[9], axis_present
+_record = struct.Struct("<QQI8I9iH")
+_index_entry = struct.Struct("<QQ")
+
+
+class RecordingFormatError(Exception):
+    pass
+
+
+def device_info_to_dict(device_info: swinput.SWINPUT_DeviceInfo):
+    return {
+        "device_hash": device_info.device_hash,
+        "type": device_info.type,
+        "vid": device_info.vid,
+        "pid": device_info.pid,
+        "usage_page": device_info.usage_page,
+        "usage": device_info.usage,
+        "hid_path": device_info.hid_path,
+        "product_name": device_info.product_name,
+        "serial_number": device_info.serial_number,
+        "manufacturer": device_info.manufacturer,
+        "button_count": device_info.button_count,
+        "axes_present": device_info.axes_present,
+        "axes_logical_min": list(device_info.axes_logical_min),
+        "axes_logical_max": list(device_info.axes_logical_max),
+    }
+
+
+def device_info_from_dict(d):
+    device_info = swinput.SWINPUT_DeviceInfo()
+    for key, value in d.items():
+        if key in ("axes_logical_min", "axes_logical_max"):
+            array = getattr(device_info, key)
+            for i, v in enumerate(value[:len(array)]):
+                array[i] = v
+        else:
+            setattr(device_info, key, value)
+    return device_info
+
+
+class SessionRecorder:
+
+    def __init__(self, path, device_infos, qpc_frequency=None):
+        if qpc_frequency is None:
+            qpc_frequency = swinput.get_qpc_frequency()
+        self.path = path
+        self.qpc_frequency = qpc_frequency
+        self.record_count = 0
+        self._index = list()
+        device_table = json.dumps([device_info_to_dict(d) for d in device_infos]).encode("utf-8")
+        self._device_table_size = len(device_table)
+        self._file = open(path, "wb")
+        self._file.write(self._pack_header(0, 0))
+        self._file.write(device_table)
+
+    def _pack_header(self, index_offset, index_count):
+        return _header.pack(MAGIC, VERSION, _record.size, self._device_table_size, self.qpc_frequency,
+                            self.record_count, index_offset, index_count)
+
+    def write(self, report: swinput.SWINPUT_DecodedReport):
+        if self.record_count % INDEX_STRIDE == 0:
+            self._index.append((report.qpc, self.record_count))
+            # the records reach the disk regularly, a session that was not closed can still be opened
+            self._file.flush()
+        self._file.write(_record.pack(
+            report.device_hash, report.qpc, report.button_count, *report.buttons, *report.axis,
+            report.axis_present
+        ))
+        self.record_count += 1
+
+    def write_batch(self, batch):
+        for report in batch:
+            self.write(report)
+
+    def close(self):
+        if self._file is None:
+            return
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(_index_entry.pack(*entry))
+        self._file.seek(0)
+        self._file.write(self._pack_header(index_offset, len(self._index)))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SessionPlayer:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = None
+        try:
+            if os.fstat(self._file.fileno()).st_size < _header.size:
+                raise RecordingFormatError(f"\"{path}\" is too short to be a recording")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._load(path)
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise RecordingFormatError(f"\"{path}\" is damaged: {e}") from e
+        except BaseException:
+            self.close()
+            raise
+
+    def _load(self, path):
+        (magic, version, record_size, device_table_size, self.qpc_frequency, self.record_count,
+         index_offset, index_count) = _header.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise RecordingFormatError(f"\"{path}\" is not a recording")
+        if version != VERSION or record_size != _record.size:
+            raise RecordingFormatError(f"\"{path}\" has unsupported version {version}")
+        table_start = _header.size
+        self.device_infos = [
+            device_info_from_dict(d)
+            for d in json.loads(self._map[table_start:table_start + device_table_size].decode("utf-8"))
+        ]
+        self._records_offset = table_start + device_table_size
+        self._index_qpcs = list()
+        self._index_records = list()
+        self.recovered = index_offset == 0
+        if self.recovered:
+            # not closed properly, the index is rebuilt from the complete records
+            self.record_count = max(0, len(self._map) - self._records_offset) // _record.size
+            for record_no in range(0, self.record_count, INDEX_STRIDE):
+                self._index_qpcs.append(self.qpc_at(record_no))
+                self._index_records.append(record_no)
+            logging.warning(f"\"{path}\" was not closed properly, recovered {self.record_count} records")
+        for i in range(index_count):
+            qpc, record_no = _index_entry.unpack_from(self._map, index_offset + i * _index_entry.size)
+            self._index_qpcs.append(qpc)
+            self._index_records.append(record_no)
+        self._report = swinput.SWINPUT_DecodedReport()
+
+    def __len__(self):
+        return self.record_count
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def qpc_at(self, record_no):
+        return struct.unpack_from("<Q", self._map, self._records_offset + record_no * _record.size + 8)[0]
+
+    @property
+    def first_qpc(self):
+        return self.qpc_at(0) if self.record_count else 0
+
+    @property
+    def duration(self):
+        if self.record_count == 0:
+            return 0.0
+        return (self.qpc_at(self.record_count - 1) - self.first_qpc) / self.qpc_frequency
+
+    def read(self, record_no, report=None):
+        # decodes into a reused report unless one is given
+        if report is None:
+            report = self._report
+        values = _record.unpack_from(self._map, self._records_offset + record_no * _record.size)
+        report.device_hash, report.qpc, report.button_count = values[0:3]
+        report.buttons[:] = values[3:11]
+        report.axis[:] = values[11:20]
+        report.axis_present = values[20]
+        return report
+
+    def seek(self, seconds):
+        # returns the number of the first record at or after the given offset into the session
+        qpc = self.first_qpc + int(seconds * self.qpc_frequency)
+        # the last index entry below qpc, records before an entry equal to qpc may carry the same qpc
+        i = bisect_left(self._index_qpcs, qpc) - 1
+        lo = self._index_records[i] if i >= 0 else 0
+        hi = self._index_records[i + 1] if i + 1 < len(self._index_records) else self.record_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.qpc_at(mid) < qpc:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def cursor(self, speed=1.0, start=0.0):
+        return ReplayCursor(self, speed, self.seek(start))
+
+    def replay(self, dispatch, speed=1.0, start=0.0):
+        # blocking replay, speed None or 0 replays as fast as possible
+        cursor = self.cursor(speed, start)
+        while not cursor.finished:
+            for report in cursor.due():
+                dispatch(report)
+            delay = cursor.time_to_next()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class ReplayCursor:
+
+    def __init__(self, player: SessionPlayer, speed=1.0, position=0):
+        self.player = player
+        self.speed = speed
+        self.position = position
+        self._start_qpc = player.qpc_at(position) if position < len(player) else 0
+        self._start_time = None  # the clock starts with the first due(), not when the cursor is created
+
+    @property
+    def finished(self):
+        return self.position >= len(self.player)
+
+    def _elapsed_qpc(self):
+        if self._start_time is None:
+            return 0.0
+        return (time.perf_counter() - self._start_time) * self.speed * self.player.qpc_frequency
+
+    def due(self, max_reports=None):
+        # yields the reports that are due by now, each valid until the next one is yielded
+        player = self.player
+        count = 0
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+        if self.speed:
+            limit_qpc = self._start_qpc + self._elapsed_qpc()
+        while self.position < len(player):
+            if max_reports is not None and count >= max_reports:
+                return
+            if self.speed and player.qpc_at(self.position) > limit_qpc:
+                return
+            report = player.read(self.position)
+            self.position += 1
+            count += 1
+            yield report
+
+    def time_to_next(self):
+        if self.finished or not self.speed:
+            return 0.0
+        ahead = self.player.qpc_at(self.position) - self._start_qpc - self._elapsed_qpc()
+        return max(0.0, ahead / self.player.qpc_frequency / self.speed)
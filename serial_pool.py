@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+
+import serial
+from serial.serialutil import SerialException
+
+
+class SerialSession:
+    # one port per device that stays open between commands and is closed after idle_timeout seconds without use,
+    # the port is located again after errors and resets since the device may come back under another name
+
+    def __init__(self, locate_port, idle_timeout=5.0, open_timeout=1.0, **settings):
+        # locate_port() returns the port name of the device or raises TimeoutError
+        self.locate_port = locate_port
+        self.idle_timeout = idle_timeout
+        self.open_timeout = open_timeout
+        self.settings = settings
+        self.lock = threading.RLock()
+        self.port = None
+        self.serial_itf = None
+        self.last_used = 0.0
+        self.open_count = 0
+
+    @property
+    def is_open(self):
+        return self.serial_itf is not None and self.serial_itf.is_open
+
+    def open(self):
+        with self.lock:
+            if self.is_open:
+                return self.serial_itf
+            if self.port is None:
+                self.port = self.locate_port()
+            timeout_at = time.monotonic() + self.open_timeout
+            while True:
+                try:
+                    self.serial_itf = serial.Serial(port=self.port, **self.settings)
+                    self.serial_itf.reset_input_buffer()
+                    break
+                except (SerialException, OSError) as e:
+                    logging.debug(e)
+                    self.serial_itf = None
+                    if time.monotonic() > timeout_at:
+                        port, self.port = self.port, None
+                        raise TimeoutError(f"could not open \"{port}\"")
+                    time.sleep(0.05)
+            self.open_count += 1
+            self.last_used = time.monotonic()
+            logging.debug(f"opened \"{self.port}\"")
+            return self.serial_itf
+
+    def close(self, forget_port=False):
+        # forget_port is used when the device resets or enters the bootloader
+        with self.lock:
+            if self.serial_itf is not None:
+                try:
+                    self.serial_itf.close()
+                except (SerialException, OSError) as e:
+                    logging.debug(e)
+                self.serial_itf = None
+                logging.debug(f"closed \"{self.port}\"")
+            if forget_port:
+                self.port = None
+
+    def transact(self, request, fun, retries=1):
+        # writes request and returns fun(serial_itf) reading the answers, with the port locked and open. Input left
+        # over from earlier transactions, e.g. late answers to timed out commands, is discarded first. Only opening
+        # the port and writing are retried after I/O errors, a request that was written is never sent again.
+        with self.lock:
+            for attempt in range(retries + 1):
+                try:
+                    serial_itf = self.open()
+                    serial_itf.reset_input_buffer()
+                    serial_itf.write(request)
+                    break
+                except (SerialException, OSError) as e:
+                    logging.debug(f"error on \"{self.port}\": {e}")
+                    self.close(forget_port=True)
+                    if attempt == retries:
+                        raise
+            try:
+                result = fun(serial_itf)
+            except (SerialException, OSError) as e:
+                logging.debug(f"error on \"{self.port}\": {e}")
+                self.close(forget_port=True)
+                raise
+            self.last_used = time.monotonic()
+            return result
+
+    def close_if_idle(self, now):
+        if not self.lock.acquire(blocking=False):
+            return  # in use
+        try:
+            if self.is_open and now - self.last_used > self.idle_timeout:
+                self.close()
+        finally:
+            self.lock.release()
+
+
+class SerialPool:
+
+    def __init__(self, idle_timeout=5.0, reap_interval=1.0, **settings):
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.settings = settings
+        self.sessions = dict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+
+    def get(self, key, locate_port):
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = SerialSession(locate_port, self.idle_timeout, **self.settings)
+                self.sessions[key] = session
+            else:
+                session.locate_port = locate_port  # the device object may have been recreated
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="serial-pool", daemon=True)
+                self._reaper.start()
+        return session
+
+    def discard(self, key, session=None):
+        # with session given, the entry is only removed if it still belongs to that session
+        with self._lock:
+            if session is not None and self.sessions.get(key) is not session:
+                return
+            session = self.sessions.pop(key, None)
+        if session is not None:
+            session.close(forget_port=True)
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.close()
+
+    def _reap(self):
+        while not self._stop.wait(self.reap_interval):
+            now = time.monotonic()
+            with self._lock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                session.close_if_idle(now)
+
+
+pool = SerialPool(
+    baudrate=9600,
+    bytesize=serial.EIGHTBITS,
+    parity=serial.PARITY_NONE,
+    stopbits=serial.STOPBITS_ONE,
+    xonxoff=False,
+    rtscts=False,
+    dsrdtr=False,
+    timeout=1,
+)
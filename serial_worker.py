@@ -0,0 +1,136 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+
+
+class SerialWorker:
+    # runs the serial I/O of one device on its own thread, jobs are queued and answered with futures
+
+    def __init__(self, name, default_timeout=5.0):
+        self.name = name
+        self.default_timeout = default_timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, fun, *args, timeout=None):
+        # the future fails with TimeoutError if the job has not finished timeout seconds after submission
+        future = Future()
+        future.deadline = time.monotonic() + (self.default_timeout if timeout is None else timeout)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._queue.put((future, fun, args))
+        return future
+
+    def stop(self):
+        # pending jobs are cancelled, a running job is finished
+        with self._lock:
+            if self._thread is None:
+                return
+            self._thread = None
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            future, fun, args = job
+            if future.done() or not future.set_running_or_notify_cancel():
+                continue  # timed out or cancelled while queued
+            if time.monotonic() > future.deadline:
+                future.set_exception(TimeoutError(f"{self.name}: {fun.__name__} timed out while queued"))
+                continue
+            try:
+                result = fun(*args)
+            except Exception as e:
+                try:
+                    future.set_exception(e)
+                except InvalidStateError:
+                    logging.debug(f"{self.name}: {fun.__name__} failed after its timeout: {e}")
+            else:
+                try:
+                    future.set_result(result)
+                except InvalidStateError:
+                    logging.debug(f"{self.name}: {fun.__name__} finished after its timeout")
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[0].cancel()
+
+
+class TkDelivery:
+    # hands finished futures to callbacks on the Tk thread by polling with after(),
+    # and fails watched futures that are still running at their deadline
+
+    def __init__(self, widget, interval=20):
+        self.widget = widget
+        self.interval = interval
+        self.pending = deque()
+        self.watched = set()
+        self.widget.after(self.interval, self.poll)
+
+    def call_soon(self, fun, *args):
+        # may be called from any thread
+        self.pending.append((fun, args))
+
+    def watch(self, future):
+        self.watched.add(future)
+
+    def poll(self):
+        now = time.monotonic()
+        for future in list(self.watched):
+            if future.done():
+                self.watched.discard(future)
+            elif now > future.deadline:
+                self.watched.discard(future)
+                try:
+                    future.set_exception(TimeoutError("serial command timed out"))
+                except InvalidStateError:
+                    pass
+        while self.pending:
+            fun, args = self.pending.popleft()
+            try:
+                fun(*args)
+            except Exception as e:
+                logging.error(e)
+        self.widget.after(self.interval, self.poll)
+
+
+delivery = None
+
+
+def install(widget, interval=20):
+    global delivery
+    delivery = TkDelivery(widget, interval)
+    return delivery
+
+
+def then(future, on_result, on_error=None):
+    # on_result(result) or on_error(exception) is called on the Tk thread once the future is done,
+    # without an installed delivery (e.g. in scripts) they are called on the worker thread
+    def done(f):
+        if f.cancelled():
+            return
+        e = f.exception()
+        if e is None:
+            on_result(f.result())
+        elif on_error is not None:
+            on_error(e)
+        else:
+            logging.error(e)
+
+    if delivery is None:
+        future.add_done_callback(done)
+    else:
+        delivery.watch(future)
+        future.add_done_callback(lambda f: delivery.call_soon(done, f))
+    return future
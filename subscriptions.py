@@ -0,0 +1,147 @@
+import tkinter
+import weakref
+from inspect import ismethod
+from itertools import count
+
+_handles = count(1)  # handles are unique across registries
+
+
+class ChangeSet:
+    # changed controls of one device, collected over one report or one frame
+    # qpc is the capture timestamp of the newest report that contributed to the changes
+    __slots__ = ("device", "changes", "qpc")
+
+    def __init__(self, device, changes: dict, qpc=0):
+        self.device = device
+        self.changes = changes
+        self.qpc = qpc
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes.items())
+
+    def __contains__(self, control):
+        return control in self.changes
+
+
+class Subscription:
+    __slots__ = ("handle", "kind", "control", "control_type", "index_range", "_fun", "_weak")
+
+    def __init__(self, handle, kind, fun, control=None, control_type=None, index_range=None, on_expire=None,
+                 weak=None):
+        self.handle = handle
+        self.kind = kind
+        self.control = control
+        self.control_type = control_type
+        self.index_range = index_range
+        # methods of Tk widgets are held weakly by default and expire with their widget,
+        # weak=True does the same for any bound method, other callbacks are held strongly
+        if weak is None:
+            weak = ismethod(fun) and isinstance(fun.__self__, tkinter.Misc)
+        elif weak and not ismethod(fun):
+            raise ValueError("only bound methods can be held weakly")
+        self._weak = weak
+        self._fun = weakref.WeakMethod(fun, on_expire) if self._weak else fun
+
+    @property
+    def callback(self):
+        return self._fun() if self._weak else self._fun
+
+    @property
+    def filtered(self):
+        return self.control_type is not None or self.index_range is not None
+
+    def matches(self, control):
+        if self.control_type is not None and not isinstance(control, self.control_type):
+            return False
+        if self.index_range is not None and getattr(control, "index", None) not in self.index_range:
+            return False
+        return True
+
+
+class SubscriptionRegistry:
+    CONTROL = "control"  # fun(value) for one control
+    CHANGE = "change"  # fun(control, value) for every matching change
+    CHANGESET = "changeset"  # fun(changeset) once per report or frame
+
+    def __init__(self):
+        self._subscriptions = dict()
+        self._by_control = dict()
+        self._change = dict()
+        self._changeset = dict()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, kind, fun, control=None, control_type=None, index_range=None, weak=None):
+        handle = next(_handles)
+        subscription = Subscription(handle, kind, fun, control, control_type, index_range,
+                                    on_expire=lambda ref, h=handle: self.unsubscribe(h), weak=weak)
+        self._subscriptions[handle] = subscription
+        if kind == self.CONTROL:
+            self._by_control.setdefault(control, dict())[handle] = subscription
+        elif kind == self.CHANGE:
+            self._change[handle] = subscription
+        elif kind == self.CHANGESET:
+            self._changeset[handle] = subscription
+        else:
+            raise ValueError(f"unknown subscription kind \"{kind}\"")
+        return handle
+
+    def unsubscribe(self, handle):
+        subscription = self._subscriptions.pop(handle, None)
+        if subscription is None:
+            return False
+        if subscription.kind == self.CONTROL:
+            subscriptions = self._by_control[subscription.control]
+            del subscriptions[handle]
+            if not subscriptions:
+                del self._by_control[subscription.control]
+        elif subscription.kind == self.CHANGE:
+            del self._change[handle]
+        else:
+            del self._changeset[handle]
+        return True
+
+    def find(self, fun, control=None):
+        for subscription in self._subscriptions.values():
+            if subscription.callback == fun and (control is None or subscription.control == control):
+                yield subscription.handle
+
+    def clear(self):
+        self._subscriptions.clear()
+        self._by_control.clear()
+        self._change.clear()
+        self._changeset.clear()
+
+    def dispatch(self, changeset: ChangeSet):
+        self.dispatch_changeset(changeset)
+        for control, value in changeset:
+            self.dispatch_change(control, value)
+
+    def dispatch_changeset(self, changeset: ChangeSet):
+        for subscription in tuple(self._changeset.values()):
+            fun = subscription.callback
+            if fun is None:
+                continue
+            if subscription.filtered:
+                changes = {c: v for c, v in changeset.changes.items() if subscription.matches(c)}
+                if changes:
+                    fun(ChangeSet(changeset.device, changes, changeset.qpc))
+            else:
+                fun(changeset)
+
+    def dispatch_change(self, control, value):
+        # CHANGE and CONTROL subscribers see every change as it happens, they are never coalesced
+        for subscription in tuple(self._change.values()):
+            fun = subscription.callback
+            if fun is not None and subscription.matches(control):
+                fun(control, value)
+        subscriptions = self._by_control.get(control)
+        if subscriptions:
+            for subscription in tuple(subscriptions.values()):
+                fun = subscription.callback
+                if fun is not None:
+                    fun(value)
@@ -1,12 +1,7 @@
 from ctypes import *
-from pathlib import Path
+import importlib
 import os
-
-HERE = Path(__file__).resolve().parent  # directory containing host.py
-# Allow Windows to resolve dependent DLLs from this folder too (Python 3.8+)
-os.add_dll_directory(str(HERE))
-dll_path = HERE / "swinput.dll"
-dll = CDLL(str(dll_path))
+import sys
 
 SWINPUT_OK = 0
 SWINPUT_ERR = 1
@@ -64,27 +59,6 @@ class SWINPUT_CaptureParams(Structure):
         ("flags", c_uint32)
     ]
 
-dll.swinput_start_capture.argtypes = [POINTER(SWINPUT_CaptureParams)]
-dll.swinput_start_capture.restype  = c_uint8
-
-dll.swinput_stop_capture.argtypes = []
-dll.swinput_stop_capture.restype  = None
-
-dll.swinput_get_stats.argtypes = [POINTER(SWINPUT_Stats)]
-dll.swinput_get_stats.restype  = c_uint8
-
-dll.swinput_enum_devices.argtypes = [POINTER(SWINPUT_DeviceInfo), POINTER(c_uint32)]
-dll.swinput_enum_devices.restype  = c_uint8
-
-dll.swinput_read_reports.argtypes = [POINTER(c_uint8), c_uint32, c_uint32, POINTER(c_uint32)]
-dll.swinput_read_reports.restype  = c_uint8
-
-dll.swinput_decode_report.argtypes = [POINTER(c_uint8), POINTER(SWINPUT_DecodedReport)]
-dll.swinput_decode_report.restype  = c_uint8
-
-dll.swinput_get_com_port.argtypes = [c_uint64, POINTER(c_wchar)]
-dll.swinput_decode_report.restype  = c_uint8
-
 axis_names = [
     "X",
     "Y",
@@ -97,84 +71,143 @@ axis_names = [
     "Wheel"
 ]
 
-def enumerate_devices():
-    for attempt in range(2):
-        required = c_uint32(0)
+class ReportBatch:
+
+    def __init__(self, max_reports=256, max_report_size=64):
+        self.max_reports = max_reports
+        self.buffer_size = max_reports * max_report_size
+        self.buffer = (c_uint8 * self.buffer_size)()
+        self.view = memoryview(self.buffer).cast('B')
+        self.reports = (SWINPUT_DecodedReport * max_reports)()
+        self.count = 0
+        self._bytes_read = c_uint32(0)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not -self.count <= index < self.count:
+            raise IndexError("report index out of range")
+        return self.reports[index % self.count]
+
+    def __iter__(self):
+        reports = self.reports
+        for i in range(self.count):
+            yield reports[i]
+
+
+class InputBackend:
+    name = None
+
+    def enumerate_devices(self):
+        raise NotImplementedError
+
+    def start_capture(self, params: SWINPUT_CaptureParams):
+        raise NotImplementedError
 
-        # Pass 1: query required count
-        rc = dll.swinput_enum_devices(None, byref(required))
-        if rc != SWINPUT_OK:
-            raise RuntimeError(f"swinput_enum_devices(count) failed: {rc}")
+    def stop_capture(self):
+        raise NotImplementedError
 
-        n = required.value
+    def get_stats(self) -> SWINPUT_Stats:
+        raise NotImplementedError
 
-        if n == 0:
-            return []
+    def read_report_batch(self, batch: ReportBatch):
+        raise NotImplementedError
 
-        devices_array_type = SWINPUT_DeviceInfo * n
-        devices_array = devices_array_type()
+    def get_com_port(self, device_hash) -> str:
+        raise NotImplementedError
 
-        # Pass 2: provide capacity explicitly
-        capacity = c_uint32(n)
-        rc = dll.swinput_enum_devices(devices_array, byref(capacity))
+    def get_qpc_frequency(self) -> int:
+        # ticks per second of SWINPUT_DecodedReport.qpc
+        raise NotImplementedError
 
-        if rc == SWINPUT_OK:
-            return list(devices_array[:capacity.value])
 
-        if rc == SWINPUT_ERR_BUFFER_TOO_SMALL:
-            # device set changed between calls; retry
-            continue
+backends = {
+    "dll": ("swinput_dll", "DllBackend"),
+    "linux": ("swinput_linux", "LinuxBackend"),
+}
 
-        raise RuntimeError(f"swinput_enum_devices(data) failed: {rc}")
+_backend = None
 
-    raise RuntimeError("swinput_enum_devices failed: device list unstable (changed repeatedly)")
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = os.getenv("SWINPUT_BACKEND")
+        if name is None:
+            name = "dll" if sys.platform == "win32" else "linux"
+        if name not in backends:
+            raise RuntimeError(f"unknown swinput backend \"{name}\"")
+        module_name, class_name = backends[name]
+        module = importlib.import_module(module_name)
+        _backend = getattr(module, class_name)()
+    return _backend
+
+
+def set_backend(backend: InputBackend):
+    global _backend
+    stop_capture()
+    _backend = backend
+
+
+def enumerate_devices():
+    return get_backend().enumerate_devices()
+
+
+_capture_params = None
 
 
 def start_capture(buffer_size=1024 * 1024, keyframe_interval_ms=1000, flags=1):
-    params = SWINPUT_CaptureParams(buffer_size, keyframe_interval_ms, flags)
-    result = dll.swinput_start_capture(byref(params))
-    if result != 0:
-        raise RuntimeError(f"swinput_start_capture failed with error code {result}")
+    # starting an already running session with the same parameters is a no-op
+    global _capture_params
+    params = (buffer_size, keyframe_interval_ms, flags)
+    if _capture_params == params:
+        return
+    if _capture_params is not None:
+        stop_capture()
+    get_backend().start_capture(SWINPUT_CaptureParams(*params))
+    _capture_params = params
 
 
 def stop_capture():
-    result = dll.swinput_stop_capture()
-    if result != 0:
-        raise RuntimeError(f"swinput_stop_capture failed with error code {result}")
+    global _capture_params
+    if _capture_params is None:
+        return
+    _capture_params = None
+    get_backend().stop_capture()
+
+
+def is_capturing():
+    return _capture_params is not None
 
 
 def get_stats():
-    stats = SWINPUT_Stats()
-    result = dll.swinput_get_stats(byref(stats))
-    if result != 0:
-        raise RuntimeError(f"swinput_get_stats failed with error code {result}")
-    return stats
+    return get_backend().get_stats()
+
+
+_default_batch = None
+
+
+def read_report_batch(batch=None):
+    # reports in the returned batch are only valid until the batch is read into again
+    global _default_batch
+    if batch is None:
+        if _default_batch is None:
+            _default_batch = ReportBatch()
+        batch = _default_batch
+    get_backend().read_report_batch(batch)
+    return batch
 
 
 def read_reports(max_reports=256):
-    buffer_size = max_reports * 64  # assuming max report size is 64 bytes
-    buffer = (c_uint8 * buffer_size)()
-    reports_read = c_uint32(0)
-    
-    result = dll.swinput_read_reports(buffer, buffer_size, max_reports, byref(reports_read))
-    if result != 0:
-        raise RuntimeError(f"swinput_read_reports failed with error code {result}")
-    
-    off = 0
-
-    while off+4 <= reports_read.value:
-        report_size = int.from_bytes(buffer[off:off+4], 'little')
-        if off + report_size > reports_read.value:
-            break
-        rec = (c_uint8 * report_size)(*buffer[off:off+report_size])
-        this_report = SWINPUT_DecodedReport()
-        dll.swinput_decode_report(rec, byref(this_report))
-        off += report_size
-        yield this_report
+    batch = read_report_batch(ReportBatch(max_reports))
+    for this_report in batch:
+        yield SWINPUT_DecodedReport.from_buffer_copy(this_report)
+
 
 def get_com_port(device_hash):
-    comport = create_unicode_buffer(32)
-    result = dll.swinput_get_com_port(device_hash, comport)
-    if result != 0:
-        raise RuntimeError(f"swinput_get_com_port failed with error code {result}")
-    return comport.value
\ No newline at end of file
+    return get_backend().get_com_port(device_hash)
+
+
+def get_qpc_frequency():
+    return get_backend().get_qpc_frequency()
@@ -0,0 +1,198 @@
+import asyncio
+from collections import deque
+
+import swinput
+from capture import acquire_capture, release_capture
+
+DROP_OLDEST = "drop-oldest"
+BLOCK = "block"
+
+
+class ReportStream:
+
+    def __init__(self, hub, maxsize=256, policy=DROP_OLDEST):
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"unknown backpressure policy \"{policy}\"")
+        self._hub = hub
+        self._queue = asyncio.Queue(maxsize)
+        # BLOCK streams park reports here while their queue is full, so a slow consumer never stalls the hub
+        self._pending = deque()
+        self._feeder = None
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self._queue.empty():
+            raise StopAsyncIteration
+        report = await self._queue.get()
+        if report is None:
+            raise StopAsyncIteration
+        return report
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def depth(self):
+        return self._queue.qsize() + len(self._pending)
+
+    def _offer(self, report):
+        if self.policy == BLOCK:
+            if self._pending or self._queue.full():
+                self._pending.append(report)
+                if self._feeder is None:
+                    self._feeder = asyncio.get_running_loop().create_task(self._feed())
+            else:
+                self._queue.put_nowait(report)
+            return
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(report)
+
+    async def _feed(self):
+        try:
+            while self._pending:
+                await self._queue.put(self._pending[0])
+                self._pending.popleft()
+        finally:
+            self._feeder = None
+
+    def _finish(self):
+        if self._feeder is not None:
+            self._feeder.cancel()
+            self._feeder = None
+        self.dropped += len(self._pending)
+        self._pending.clear()
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(None)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._hub.remove(self)
+        self._finish()
+
+
+class ReportHub:
+
+    def __init__(self, capture=None):
+        # without a capture the hub shares the process-wide capture thread with every other consumer
+        self._loop = asyncio.get_running_loop()
+        self._owns_capture = capture is None
+        self.capture = capture
+        self._consumers = list()
+        self._incoming = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _tap(self, batch):
+        # called from the capture thread, batches are recycled after the call so the reports are copied
+        self._incoming.extend(swinput.SWINPUT_DecodedReport.from_buffer_copy(report) for report in batch)
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # the loop is closed, get_hub() releases the hub
+
+    def add(self, maxsize=256, policy=DROP_OLDEST):
+        consumer = ReportStream(self, maxsize, policy)
+        self._consumers.append(consumer)
+        if self._task is None:
+            if self._owns_capture:
+                self.capture = acquire_capture(tap=self._tap)
+            else:
+                self.capture.add_tap(self._tap)
+            self._task = self._loop.create_task(self._run())
+        return consumer
+
+    def remove(self, consumer):
+        if consumer in self._consumers:
+            self._consumers.remove(consumer)
+        if not self._consumers:
+            self.close()
+
+    def close(self):
+        consumers, self._consumers = self._consumers, list()
+        for consumer in consumers:
+            consumer.closed = True
+            consumer._finish()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._release()
+
+    def _release(self):
+        # the part of close() that does not need the loop, which may already be closed
+        if self.capture is not None:
+            self.capture.remove_tap(self._tap)
+            if self._owns_capture:
+                release_capture(self.capture)
+                self.capture = None
+        self._incoming.clear()
+        if _hubs.get(self._loop) is self:
+            del _hubs[self._loop]
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._incoming:
+                    report = self._incoming.popleft()
+                    for consumer in list(self._consumers):
+                        consumer._offer(report)
+        finally:
+            # the task is cancelled by close(), or by the loop shutting down without it
+            if self._task is not None:
+                self._task = None
+                self.close()
+
+    def get_counters(self):
+        counters = self.capture.get_counters() if self.capture is not None else dict()
+        counters["consumers"] = [
+            {"policy": c.policy, "depth": c.depth, "dropped": c.dropped} for c in self._consumers
+        ]
+        return counters
+
+
+_hubs = dict()
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    for hub in [hub for other, hub in _hubs.items() if other.is_closed()]:
+        hub._release()
+    hub = _hubs.get(loop)
+    if hub is None or hub._task is None:
+        hub = ReportHub()
+        _hubs[loop] = hub
+    return hub
+
+
+def stream(maxsize=256, policy=DROP_OLDEST):
+    return get_hub().add(maxsize, policy)
+
+
+async def enumerate_devices():
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, swinput.enumerate_devices)
+
+
+async def get_stats():
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, swinput.get_stats)
+
+
+async def get_com_port(device_hash):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, swinput.get_com_port, device_hash)
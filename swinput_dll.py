@@ -0,0 +1,123 @@
+from ctypes import *
+from pathlib import Path
+import os
+import struct
+
+from swinput import *
+
+HERE = Path(__file__).resolve().parent  # directory containing swinput.dll
+
+
+class DllBackend(InputBackend):
+    name = "dll"
+
+    def __init__(self, dll_path=HERE / "swinput.dll"):
+        # Allow Windows to resolve dependent DLLs from this folder too (Python 3.8+)
+        os.add_dll_directory(str(Path(dll_path).parent))
+        dll = CDLL(str(dll_path))
+
+        dll.swinput_start_capture.argtypes = [POINTER(SWINPUT_CaptureParams)]
+        dll.swinput_start_capture.restype = c_uint8
+
+        dll.swinput_stop_capture.argtypes = []
+        dll.swinput_stop_capture.restype = None
+
+        dll.swinput_get_stats.argtypes = [POINTER(SWINPUT_Stats)]
+        dll.swinput_get_stats.restype = c_uint8
+
+        dll.swinput_enum_devices.argtypes = [POINTER(SWINPUT_DeviceInfo), POINTER(c_uint32)]
+        dll.swinput_enum_devices.restype = c_uint8
+
+        dll.swinput_read_reports.argtypes = [POINTER(c_uint8), c_uint32, c_uint32, POINTER(c_uint32)]
+        dll.swinput_read_reports.restype = c_uint8
+
+        dll.swinput_decode_report.argtypes = [POINTER(c_uint8), POINTER(SWINPUT_DecodedReport)]
+        dll.swinput_decode_report.restype = c_uint8
+
+        dll.swinput_get_com_port.argtypes = [c_uint64, POINTER(c_wchar)]
+        dll.swinput_get_com_port.restype = c_uint8
+
+        self.dll = dll
+        self._record_header = struct.Struct("<I")
+
+    def enumerate_devices(self):
+        for attempt in range(2):
+            required = c_uint32(0)
+
+            # Pass 1: query required count
+            rc = self.dll.swinput_enum_devices(None, byref(required))
+            if rc != SWINPUT_OK:
+                raise RuntimeError(f"swinput_enum_devices(count) failed: {rc}")
+
+            n = required.value
+
+            if n == 0:
+                return []
+
+            devices_array_type = SWINPUT_DeviceInfo * n
+            devices_array = devices_array_type()
+
+            # Pass 2: provide capacity explicitly
+            capacity = c_uint32(n)
+            rc = self.dll.swinput_enum_devices(devices_array, byref(capacity))
+
+            if rc == SWINPUT_OK:
+                return list(devices_array[:capacity.value])
+
+            if rc == SWINPUT_ERR_BUFFER_TOO_SMALL:
+                # device set changed between calls; retry
+                continue
+
+            raise RuntimeError(f"swinput_enum_devices(data) failed: {rc}")
+
+        raise RuntimeError("swinput_enum_devices failed: device list unstable (changed repeatedly)")
+
+    def start_capture(self, params):
+        result = self.dll.swinput_start_capture(byref(params))
+        if result != 0:
+            raise RuntimeError(f"swinput_start_capture failed with error code {result}")
+
+    def stop_capture(self):
+        self.dll.swinput_stop_capture()
+
+    def get_stats(self):
+        stats = SWINPUT_Stats()
+        result = self.dll.swinput_get_stats(byref(stats))
+        if result != 0:
+            raise RuntimeError(f"swinput_get_stats failed with error code {result}")
+        return stats
+
+    def read_report_batch(self, batch):
+        batch.count = 0
+        result = self.dll.swinput_read_reports(batch.buffer, batch.buffer_size, batch.max_reports, byref(batch._bytes_read))
+        if result != 0:
+            raise RuntimeError(f"swinput_read_reports failed with error code {result}")
+
+        bytes_read = batch._bytes_read.value
+        base = addressof(batch.buffer)
+        unpack_from = self._record_header.unpack_from
+        decode_report = self.dll.swinput_decode_report
+        off = 0
+        count = 0
+        while off + 4 <= bytes_read and count < batch.max_reports:
+            report_size, = unpack_from(batch.view, off)
+            if report_size == 0 or off + report_size > bytes_read:
+                break
+            rec = cast(base + off, POINTER(c_uint8))
+            if decode_report(rec, byref(batch.reports[count])) == SWINPUT_OK:
+                count += 1
+            off += report_size
+        batch.count = count
+
+    def get_com_port(self, device_hash):
+        comport = create_unicode_buffer(32)
+        result = self.dll.swinput_get_com_port(device_hash, comport)
+        if result != 0:
+            raise RuntimeError(f"swinput_get_com_port failed with error code {result}")
+        return comport.value
+
+    def get_qpc_frequency(self):
+        frequency = c_int64(0)
+        if not windll.kernel32.QueryPerformanceFrequency(byref(frequency)):
+            raise RuntimeError("QueryPerformanceFrequency failed")
+        return frequency.value
@@ -0,0 +1,532 @@
+from ctypes import *
+from collections import deque
+import errno
+import fcntl
+import glob
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+from swinput import *
+
+RIM_TYPEHID = 2
+
+HID_USAGE_PAGE_GENERIC_DESKTOP = 0x01
+HID_USAGE_PAGE_BUTTON = 0x09
+HID_USAGE_X = 0x30  # X, Y, Z, Rx, Ry, Rz, Slider, Dial, Wheel are 0x30..0x38, same order as axis_names
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = 0
+BTN_MISC = 0x100
+BTN_TOUCH = 0x14a
+# ABS_X, ABS_Y, ABS_Z, ABS_RX, ABS_RY, ABS_RZ, ABS_THROTTLE, ABS_RUDDER, ABS_WHEEL map onto axis_names
+ABS_AXES = {code: code for code in range(9)}
+
+_input_event = struct.Struct("llHHi")
+_input_absinfo = struct.Struct("6i")
+_long_bits = struct.calcsize("l") * 8
+
+
+def _eviocgabs(code):
+    # _IOR('E', 0x40 + code, struct input_absinfo)
+    return (2 << 30) | (_input_absinfo.size << 16) | (ord('E') << 8) | (0x40 + code)
+
+
+def _fnv1a64(text):
+    h = 0xcbf29ce484222325
+    for b in text.encode("utf-8"):
+        h = ((h ^ b) * 0x100000001b3) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def _read_sysfs(path, default=""):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _find_usb_device(sysfs_path):
+    # walks up from a HID/input node to the USB device that carries idVendor, manufacturer, ...
+    path = os.path.realpath(sysfs_path)
+    while path not in ("", "/"):
+        if os.path.isfile(os.path.join(path, "idVendor")):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+
+def _signed(value, size):
+    bits = size * 8
+    if size and value & (1 << (bits - 1)):
+        return value - (1 << bits)
+    return value
+
+
+class HidField:
+    __slots__ = ("kind", "index", "bit_offset", "bit_size", "signed")
+
+    def __init__(self, kind, index, bit_offset, bit_size, signed):
+        self.kind = kind
+        self.index = index
+        self.bit_offset = bit_offset
+        self.bit_size = bit_size
+        self.signed = signed
+
+
+def parse_report_descriptor(descriptor: bytes):
+    # returns (layout, info) where layout maps report id to the input fields of that report
+    layout = dict()
+    offsets = dict()
+    info = {"usage_page": 0, "usage": 0, "button_count": 0, "axes_present": 0,
+            "axes_logical_min": [0] * 16, "axes_logical_max": [0] * 16, "report_ids": False}
+    glob_state = {"usage_page": 0, "logical_min": 0, "logical_max": 0, "report_size": 0, "report_id": 0,
+                  "report_count": 0, "logical_max_raw": 0}
+    glob_stack = list()
+    usages = list()
+    usage_min = None
+    collection_depth = 0
+
+    i = 0
+    while i < len(descriptor):
+        prefix = descriptor[i]
+        if prefix == 0xFE:  # long item
+            if i + 1 >= len(descriptor):
+                break
+            i += 3 + descriptor[i + 1]
+            continue
+        size = (0, 1, 2, 4)[prefix & 0x03]
+        item_type = (prefix >> 2) & 0x03
+        tag = prefix >> 4
+        raw = int.from_bytes(descriptor[i + 1:i + 1 + size], "little")
+        i += 1 + size
+
+        if item_type == 1:  # global
+            if tag == 0x0:
+                glob_state["usage_page"] = raw
+            elif tag == 0x1:
+                glob_state["logical_min"] = _signed(raw, size)
+            elif tag == 0x2:
+                glob_state["logical_max"] = _signed(raw, size)
+                glob_state["logical_max_raw"] = raw
+            elif tag == 0x7:
+                glob_state["report_size"] = raw
+            elif tag == 0x8:
+                glob_state["report_id"] = raw
+                info["report_ids"] = True
+            elif tag == 0x9:
+                glob_state["report_count"] = raw
+            elif tag == 0xA:
+                glob_stack.append(dict(glob_state))
+            elif tag == 0xB and glob_stack:
+                glob_state = glob_stack.pop()
+            continue
+
+        if item_type == 2:  # local
+            if tag == 0x0:
+                usages.append(raw if size == 4 else (glob_state["usage_page"] << 16) | raw)
+            elif tag == 0x1:
+                usage_min = raw if size == 4 else (glob_state["usage_page"] << 16) | raw
+            elif tag == 0x2 and usage_min is not None:
+                usage_max = raw if size == 4 else (glob_state["usage_page"] << 16) | raw
+                usages.extend(range(usage_min, usage_max + 1))
+                usage_min = None
+            continue
+
+        if item_type != 0:
+            continue
+
+        # main items
+        if tag == 0xA:  # collection
+            if collection_depth == 0 and info["usage_page"] == 0 and usages:
+                info["usage_page"] = usages[0] >> 16
+                info["usage"] = usages[0] & 0xFFFF
+            collection_depth += 1
+        elif tag == 0xC:  # end collection
+            collection_depth = max(0, collection_depth - 1)
+        elif tag == 0x8:  # input
+            report_id = glob_state["report_id"]
+            fields = layout.setdefault(report_id, list())
+            offset = offsets.get(report_id, 0)
+            bit_size = glob_state["report_size"]
+            logical_min = glob_state["logical_min"]
+            logical_max = glob_state["logical_max"]
+            if logical_min >= 0 > logical_max:
+                logical_max = glob_state["logical_max_raw"]
+            constant = raw & 0x01
+            variable = raw & 0x02
+            for n in range(glob_state["report_count"]):
+                if not constant and variable and usages:
+                    usage = usages[min(n, len(usages) - 1)]
+                    page = usage >> 16
+                    usage_id = usage & 0xFFFF
+                    if page == HID_USAGE_PAGE_BUTTON and 1 <= usage_id <= 256:
+                        fields.append(HidField("button", usage_id - 1, offset, bit_size, False))
+                        info["button_count"] = max(info["button_count"], usage_id)
+                    elif page == HID_USAGE_PAGE_GENERIC_DESKTOP and HID_USAGE_X <= usage_id < HID_USAGE_X + 9:
+                        axis_id = usage_id - HID_USAGE_X
+                        fields.append(HidField("axis", axis_id, offset, bit_size, logical_min < 0))
+                        info["axes_present"] |= 1 << axis_id
+                        info["axes_logical_min"][axis_id] = logical_min
+                        info["axes_logical_max"][axis_id] = logical_max
+                offset += bit_size
+            offsets[report_id] = offset
+        if tag in (0x8, 0x9, 0xA, 0xB, 0xC):
+            usages = list()
+            usage_min = None
+
+    return layout, info
+
+
+class InputNode:
+
+    def __init__(self, info: SWINPUT_DeviceInfo, path):
+        self.info = info
+        self.path = path
+        self.fd = None
+        self.state = SWINPUT_DecodedReport()
+        self.state.device_hash = info.device_hash
+        self.state.button_count = info.button_count
+        self.state.axis_present = info.axes_present
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def decode(self, data):
+        # yields once per completed report
+        raise NotImplementedError
+
+
+class HidrawNode(InputNode):
+    read_size = 4096
+
+    def __init__(self, info, path, layout, report_ids):
+        super().__init__(info, path)
+        self.layout = layout
+        self.report_ids = report_ids
+
+    def decode(self, data):
+        if self.report_ids:
+            if not data:
+                return
+            fields = self.layout.get(data[0])
+            data = data[1:]
+        else:
+            fields = self.layout.get(0)
+        if fields is None:
+            return
+        bits = int.from_bytes(data, "little")
+        state = self.state
+        for field in fields:
+            value = (bits >> field.bit_offset) & ((1 << field.bit_size) - 1)
+            if field.kind == "button":
+                word, bit = divmod(field.index, 32)
+                if value:
+                    state.buttons[word] |= 1 << bit
+                else:
+                    state.buttons[word] &= ~(1 << bit) & 0xFFFFFFFF
+            else:
+                if field.signed and value & (1 << (field.bit_size - 1)):
+                    value -= 1 << field.bit_size
+                state.axis[field.index] = value
+        yield state
+
+
+class EvdevNode(InputNode):
+    read_size = _input_event.size * 64
+
+    def __init__(self, info, path, key_codes):
+        super().__init__(info, path)
+        self.button_index = {code: i for i, code in enumerate(key_codes)}
+
+    def decode(self, data):
+        state = self.state
+        for off in range(0, len(data) - _input_event.size + 1, _input_event.size):
+            _, _, ev_type, code, value = _input_event.unpack_from(data, off)
+            if ev_type == EV_KEY:
+                index = self.button_index.get(code)
+                if index is None:
+                    continue
+                word, bit = divmod(index, 32)
+                if value:
+                    state.buttons[word] |= 1 << bit
+                else:
+                    state.buttons[word] &= ~(1 << bit) & 0xFFFFFFFF
+            elif ev_type == EV_ABS and code in ABS_AXES:
+                state.axis[ABS_AXES[code]] = value
+            elif ev_type == EV_SYN and code == SYN_REPORT:
+                yield state
+
+
+def _fill_info(info, vid, pid, name, serial, manufacturer, path):
+    info.type = RIM_TYPEHID
+    info.vid = vid
+    info.pid = pid
+    info.hid_path = path
+    info.product_name = name
+    info.serial_number = serial
+    info.manufacturer = manufacturer
+
+
+def _scan_hidraw():
+    nodes = dict()
+    hid_devices = set()
+    for sysfs in sorted(glob.glob("/sys/class/hidraw/hidraw*")):
+        hid_device = os.path.realpath(os.path.join(sysfs, "device"))
+        uevent = dict()
+        for line in _read_sysfs(os.path.join(hid_device, "uevent")).splitlines():
+            key, _, value = line.partition("=")
+            uevent[key] = value
+        try:
+            _, vid, pid = (int(x, 16) for x in uevent.get("HID_ID", "").split(":"))
+            with open(os.path.join(hid_device, "report_descriptor"), "rb") as f:
+                descriptor = f.read()
+        except (ValueError, OSError):
+            continue
+        layout, desc_info = parse_report_descriptor(descriptor)
+        if desc_info["button_count"] == 0 and desc_info["axes_present"] == 0:
+            continue
+        hid_devices.add(hid_device)
+
+        usb_device = _find_usb_device(hid_device)
+        manufacturer = _read_sysfs(os.path.join(usb_device, "manufacturer")) if usb_device else ""
+        phys = uevent.get("HID_PHYS", "")
+        serial = uevent.get("HID_UNIQ", "")
+        path = os.path.join("/dev", os.path.basename(sysfs))
+
+        info = SWINPUT_DeviceInfo()
+        info.device_hash = _fnv1a64(f"hidraw:{vid:04x}:{pid:04x}:{serial}:{phys}")
+        _fill_info(info, vid, pid, uevent.get("HID_NAME", ""), serial, manufacturer, path)
+        info.usage_page = desc_info["usage_page"]
+        info.usage = desc_info["usage"]
+        info.button_count = desc_info["button_count"]
+        info.axes_present = desc_info["axes_present"]
+        for axis_id in range(16):
+            info.axes_logical_min[axis_id] = desc_info["axes_logical_min"][axis_id]
+            info.axes_logical_max[axis_id] = desc_info["axes_logical_max"][axis_id]
+        nodes[info.device_hash] = HidrawNode(info, path, layout, desc_info["report_ids"])
+    return nodes, hid_devices
+
+
+def _parse_capabilities(text):
+    codes = list()
+    for word_index, word in enumerate(reversed(text.split())):
+        value = int(word, 16)
+        for bit in range(_long_bits):
+            if value & (1 << bit):
+                codes.append(word_index * _long_bits + bit)
+    return codes
+
+
+def _scan_evdev(hid_devices):
+    # evdev nodes are only used for devices without a hidraw node, e.g. uinput virtual devices
+    nodes = dict()
+    for sysfs in sorted(glob.glob("/sys/class/input/event*")):
+        input_device = os.path.realpath(os.path.join(sysfs, "device"))
+        if any(input_device.startswith(hid_device + os.sep) for hid_device in hid_devices):
+            continue
+        key_codes = [c for c in _parse_capabilities(_read_sysfs(os.path.join(input_device, "capabilities", "key"), "0"))
+                     if c >= BTN_MISC]
+        abs_codes = [c for c in _parse_capabilities(_read_sysfs(os.path.join(input_device, "capabilities", "abs"), "0"))
+                     if c in ABS_AXES]
+        if BTN_TOUCH in key_codes:
+            continue  # touchpads and touchscreens
+        if not key_codes and not abs_codes:
+            continue
+        key_codes = key_codes[:256]
+
+        path = os.path.join("/dev/input", os.path.basename(sysfs))
+        try:
+            vid = int(_read_sysfs(os.path.join(input_device, "id", "vendor"), "0"), 16)
+            pid = int(_read_sysfs(os.path.join(input_device, "id", "product"), "0"), 16)
+        except ValueError:
+            continue
+        usb_device = _find_usb_device(input_device)
+        manufacturer = _read_sysfs(os.path.join(usb_device, "manufacturer")) if usb_device else ""
+        phys = _read_sysfs(os.path.join(input_device, "phys"))
+        serial = _read_sysfs(os.path.join(input_device, "uniq"))
+
+        info = SWINPUT_DeviceInfo()
+        info.device_hash = _fnv1a64(f"evdev:{vid:04x}:{pid:04x}:{serial}:{phys or path}")
+        _fill_info(info, vid, pid, _read_sysfs(os.path.join(input_device, "name")), serial, manufacturer, path)
+        info.usage_page = HID_USAGE_PAGE_GENERIC_DESKTOP
+        info.usage = 0x04  # joystick
+        info.button_count = len(key_codes)
+        if abs_codes:
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                continue
+            try:
+                for code in abs_codes:
+                    absinfo = bytearray(_input_absinfo.size)
+                    fcntl.ioctl(fd, _eviocgabs(code), absinfo)
+                    _, minimum, maximum, _, _, _ = _input_absinfo.unpack(absinfo)
+                    axis_id = ABS_AXES[code]
+                    info.axes_present |= 1 << axis_id
+                    info.axes_logical_min[axis_id] = minimum
+                    info.axes_logical_max[axis_id] = maximum
+            except OSError:
+                continue
+            finally:
+                os.close(fd)
+        nodes[info.device_hash] = EvdevNode(info, path, key_codes)
+    return nodes
+
+
+def scan_nodes():
+    nodes, hid_devices = _scan_hidraw()
+    nodes.update(_scan_evdev(hid_devices))
+    return nodes
+
+
+class LinuxBackend(InputBackend):
+    name = "linux"
+    rescan_interval = 1.0
+
+    def __init__(self):
+        self._nodes = dict()
+        self._ring = deque()
+        self._ring_capacity = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._stats = SWINPUT_Stats()
+        self._keyframe_interval = 1.0
+
+    def enumerate_devices(self):
+        self._nodes = scan_nodes()
+        return [node.info for node in self._nodes.values()]
+
+    def start_capture(self, params):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._ring_capacity = max(1, params.ring_buffer_size_bytes // sizeof(SWINPUT_DecodedReport))
+        self._ring = deque()
+        self._keyframe_interval = params.keyframe_interval_ms / 1000
+        self._stats = SWINPUT_Stats()
+        self._stats.ring_bytes_capacity = self._ring_capacity * sizeof(SWINPUT_DecodedReport)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="swinput-linux", daemon=True)
+        self._thread.start()
+
+    def stop_capture(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(1.0)
+        self._thread = None
+
+    def _push(self, state, qpc):
+        state.qpc = qpc
+        self._ring.append(SWINPUT_DecodedReport.from_buffer_copy(state))
+        self._stats.reports_written += 1
+        if len(self._ring) > self._ring_capacity:
+            self._ring.popleft()
+            self._stats.ring_overflows += 1
+
+    def _open_nodes(self, active, poller):
+        for device_hash, node in scan_nodes().items():
+            if device_hash in active:
+                continue
+            try:
+                node.open()
+            except OSError as e:
+                logging.debug(f"could not open \"{node.path}\": {e}")
+                self._stats.rawinput_errors += 1
+                continue
+            active[device_hash] = node
+            poller.register(node.fd, select.POLLIN)
+            self._push(node.state, time.perf_counter_ns())  # initial keyframe
+
+    def _run(self):
+        active = dict()
+        by_fd = dict()
+        poller = select.poll()
+        next_rescan = 0
+        next_keyframe = time.monotonic() + self._keyframe_interval
+        try:
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                if now >= next_rescan:
+                    self._open_nodes(active, poller)
+                    by_fd = {node.fd: node for node in active.values()}
+                    self._stats.devices_known = len(active)
+                    next_rescan = now + self.rescan_interval
+                if self._keyframe_interval > 0 and now >= next_keyframe:
+                    for node in active.values():
+                        self._push(node.state, time.perf_counter_ns())
+                    next_keyframe = now + self._keyframe_interval
+
+                for fd, event in poller.poll(50):
+                    node = by_fd.get(fd)
+                    if node is None:
+                        continue
+                    try:
+                        if event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                            raise OSError(errno.ENODEV, "device removed")
+                        while True:
+                            data = os.read(fd, node.read_size)
+                            if not data:
+                                break
+                            qpc = time.perf_counter_ns()
+                            for state in node.decode(data):
+                                self._push(state, qpc)
+                    except BlockingIOError:
+                        pass
+                    except OSError as e:
+                        logging.debug(f"closing \"{node.path}\": {e}")
+                        poller.unregister(fd)
+                        node.close()
+                        del by_fd[fd]
+                        active.pop(node.info.device_hash, None)
+                        self._stats.devices_known = len(active)
+                self._stats.ring_bytes_used_approx = len(self._ring) * sizeof(SWINPUT_DecodedReport)
+        finally:
+            for node in active.values():
+                node.close()
+
+    def get_stats(self):
+        self._stats.ring_bytes_used_approx = len(self._ring) * sizeof(SWINPUT_DecodedReport)
+        return SWINPUT_Stats.from_buffer_copy(self._stats)
+
+    def read_report_batch(self, batch):
+        count = 0
+        ring = self._ring
+        reports = batch.reports
+        while count < batch.max_reports:
+            try:
+                reports[count] = ring.popleft()
+            except IndexError:
+                break
+            count += 1
+        batch.count = count
+
+    def get_com_port(self, device_hash):
+        node = self._nodes.get(device_hash)
+        if node is None:
+            self._nodes = scan_nodes()
+            node = self._nodes.get(device_hash)
+        if node is None:
+            raise RuntimeError(f"swinput_get_com_port failed with error code {SWINPUT_ERR_UNKNOWN_DEVICE}")
+        sysfs = os.path.join("/sys/class", "hidraw" if isinstance(node, HidrawNode) else "input",
+                             os.path.basename(node.path), "device")
+        usb_device = _find_usb_device(sysfs)
+        if usb_device is not None:
+            for tty in sorted(glob.glob("/sys/class/tty/*/device")):
+                if os.path.realpath(tty).startswith(usb_device + os.sep):
+                    return os.path.join("/dev", os.path.basename(os.path.dirname(tty)))
+        raise RuntimeError(f"swinput_get_com_port failed with error code {SWINPUT_COM_NOT_FOUND}")
+
+    def get_qpc_frequency(self):
+        return 1000000000  # qpc is time.perf_counter_ns()
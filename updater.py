@@ -13,7 +13,7 @@ from cryptography.hazmat.primitives import serialization
 from tkinter import messagebox
 from make import sha256_file
 
-appdata_path = os.path.join(os.getenv('APPDATA'), 'sw_app')
+appdata_path = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), 'sw_app')
 
 def verify_manifest(manifest_bytes, signature_bytes):
     logging.debug(f"verifying manifest...")